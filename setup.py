@@ -29,6 +29,9 @@ setup(
         'watchgod'
     ],
     extras_require={
+        'asyncssh': [
+            'asyncssh'
+        ],
         'dev': [
             'pylint',
             'pycodestyle',
@@ -1,31 +1,84 @@
 import os
+import json
 import inspect
 import importlib
 
 from pathlib import Path
+from collections import ChainMap
 
 import cerberus
 
-from roy.utils.collections import update_dict_recur
+from roy.utils.collections import LayeredMapping
+
+
+VALIDATED_CACHE_SIZE = 1024
+
+_validators = {}
+_validated = {}
+
+
+def get_validator(schema) -> cerberus.Validator:
+    """Return validator compiled once per schema object.
+
+    >>> schema = {'port': {'type': 'integer'}}
+    >>> get_validator(schema) is get_validator(schema)
+    True
+    """
+    key = id(schema)
+    if key not in _validators:
+        # keep schema referenced so its id is never reused
+        _validators[key] = (schema, cerberus.Validator(schema))
+    return _validators[key][1]
 
 
 def validate_schema(schema, settings):
-    validator = cerberus.Validator(schema)
+    """Validate settings by schema, same settings already validated
+    by same schema are not checked again.
+
+    >>> validate_schema({'port': {'type': 'integer'}}, {'port': 80})
+    {'port': 80}
+    >>> validate_schema({'port': {'type': 'integer'}}, {'port': '80'})
+    Traceback (most recent call last):
+    ...
+    ValueError: Error validation settings {'port': ['must be of integer type']}
+    """
+    try:
+        key = (id(schema), json.dumps(
+            settings, sort_keys=True, default=repr))
+    except TypeError:
+        key = None
+    if key in _validated:
+        return settings
+
+    validator = get_validator(schema)
     if not validator.validate(settings):
         raise ValueError(f"Error validation settings {validator.errors}")
+
+    if key is not None:
+        if len(_validated) >= VALIDATED_CACHE_SIZE:
+            _validated.pop(next(iter(_validated)))
+        _validated[key] = True
     return settings
 
 
-class ComponentSettings:
-    KEY = ''
-    SCHEMA = {}
-    DEFAULT = {}
+_app_settings = {}
+_components_settings = {}
+_current_dirs = {}
 
-    def __init__(self):
-        key = self.__class__.KEY
-        if not key:
-            raise ValueError(f"Provide 'KEY' for settings")
 
+def get_env_key() -> tuple:
+    """Settings variables from environment, all resolved settings are
+    cached until any of them is changed."""
+    return tuple(sorted(
+        (name, value) for name, value in os.environ.items()
+        if name.startswith('SETTINGS')
+    ))
+
+
+def load_app_settings(env_key: tuple = None) -> dict:
+    """Import app settings module from 'SETTINGS' env once."""
+    env_key = env_key or get_env_key()
+    if env_key not in _app_settings:
         app_settings = {}
         if 'SETTINGS' in os.environ:
             module_path = os.environ['SETTINGS']
@@ -34,12 +87,32 @@ class ComponentSettings:
                 app_settings = module.SETTINGS
             except ModuleNotFoundError:
                 pass
+        _app_settings[env_key] = app_settings
+    return _app_settings[env_key]
 
-        settings = update_dict_recur(
-            self.__class__.DEFAULT, app_settings.get(self.__class__.KEY, {}))
-        settings = validate_schema(self.__class__.SCHEMA, settings)
 
-        self._data = settings
+class ComponentSettings:
+    KEY = ''
+    SCHEMA = {}
+    DEFAULT = {}
+
+    def __init__(self):
+        class_ = self.__class__
+        if not class_.KEY:
+            raise ValueError(f"Provide 'KEY' for settings")
+
+        key = (get_env_key(), class_)
+        if key not in _components_settings:
+            app_settings = load_app_settings(key[0])
+            settings = LayeredMapping(
+                class_.DEFAULT, app_settings.get(class_.KEY, {}))
+            validate_schema(class_.SCHEMA, settings.to_dict())
+            _components_settings[key] = settings
+
+        # resolved settings are shared read only at every dict level,
+        # instance writes go to own top level layer so nothing is
+        # copied, lists are shared and should not be changed in place
+        self._data = ChainMap({}, _components_settings[key])
 
 
 class AppSettings(ComponentSettings):
@@ -80,11 +153,17 @@ class AppSettings(ComponentSettings):
 
     @property
     def current_dir(self):
+        env_key = get_env_key()
+        if env_key in _current_dirs:
+            return _current_dirs[env_key]
+
         try:
             current_settings = importlib.import_module(os.environ['SETTINGS'])
             dir_path = Path(inspect.getfile(current_settings)).resolve().parent
         except (KeyError, ModuleNotFoundError):
-            dir_path = Path.cwd()
+            return Path.cwd()
+
+        _current_dirs[env_key] = dir_path
         return dir_path
 
     def get_components(self):
@@ -1,4 +1,5 @@
 import os
+import copy
 import importlib
 import pathlib
 
@@ -142,6 +143,22 @@ def test_failed_load_settings(monkeypatch):
         SomeSettings()
 
 
+def test_create_settings_keeps_input(monkeypatch):
+    monkeypatch.setattr(os, 'environ', {
+        'SETTINGS_APP_DEBUG': 'true', 'SETTINGS_CACHE_REDIS_DB': '1'})
+    base = {'app': {'debug': False}, 'db': {'port': 1}}
+
+    settings = create_settings(base, {'db': {'port': 2}})
+    assert settings == {
+        'app': {'debug': True}, 'db': {'port': 2},
+        'cache': {'redis': {'db': 1}}
+    }
+    assert base == {'app': {'debug': False}, 'db': {'port': 1}}
+
+    create_settings(base)
+    assert base == {'app': {'debug': False}, 'db': {'port': 1}}
+
+
 @pytest.mark.parametrize('settings', [
     'app.settings.invalid.missing_key',
     'app.settings.invalid.schema_error'
@@ -149,3 +166,47 @@ def test_failed_load_settings(monkeypatch):
 def test_validation_component_settings(settings):
     # TODO: add negative cases
     pass
+
+
+def test_settings_resolved_once_per_env(monkeypatch):
+    imported = []
+
+    def import_module(name):
+        imported.append(name)
+        return import_fake_module(name)
+
+    monkeypatch.setattr(importlib, 'import_module', import_module)
+    monkeypatch.setattr(os, 'environ', {
+        'SETTINGS': 'app.settings.production', 'SETTINGS_APP_DEBUG': 'true'
+    })
+
+    class CachedSettings(ComponentSettings):
+        KEY = 'app'
+        DEFAULT = {'port': 8000, 'systemd': {'boot': True}}
+        SCHEMA = {
+            'debug': {'type': 'boolean'},
+            'items': {'type': 'list'},
+            'port': {'type': 'integer'},
+            'systemd': {'type': 'dict'}
+        }
+
+    def deepcopy(*args, **kwargs):
+        raise AssertionError('settings should not be copied')
+
+    monkeypatch.setattr(copy, 'deepcopy', deepcopy)
+
+    first, second = CachedSettings(), CachedSettings()
+    assert first._data == second._data
+    assert first._data is not second._data
+    assert first._data.maps[-1] is second._data.maps[-1]
+    CachedSettings()._data['port'] = 8080
+    assert second._data['port'] == 80
+    assert first._data['port'] == 80 and first._data['debug']
+    with pytest.raises(TypeError):
+        first._data['systemd']['boot'] = False
+    assert CachedSettings.DEFAULT['systemd'] == {'boot': True}
+    assert imported == ['app.settings.production']
+
+    os.environ['SETTINGS_APP_PORT'] = '9020'
+    assert CachedSettings()._data['port'] == 9020
+    assert len(imported) == 2
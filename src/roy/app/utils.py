@@ -15,8 +15,9 @@ def _convert_value(value):
 
 
 def create_settings(settings: dict = None, update_with: dict = None):
-    """Create app settings dict, overrided by env."""
-    settings = settings or {}
+    """Create app settings dict, overrided by env, dicts on overrided
+    paths are copied so passed `settings` are not changed."""
+    settings = dict(settings or {})
     if update_with:
         settings = update_dict_recur(settings, update_with)
 
@@ -33,5 +34,6 @@ def create_settings(settings: dict = None, update_with: dict = None):
             if index == last_index:
                 current_settings[part] = _convert_value(value)
             else:
-                current_settings = current_settings.setdefault(part, {})
+                current_settings[part] = dict(current_settings.get(part, {}))
+                current_settings = current_settings[part]
     return settings
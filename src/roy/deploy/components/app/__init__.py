@@ -3,9 +3,7 @@ import asyncio
 from pathlib import Path
 from typing import Generator
 
-from watchgod import awatch
-
-from ...tasks import DeployTasks, nohost, register
+from ...tasks import DeployTasks, incremental, nohost, register
 from ...settings import DeployComponentSettings, SETTINGS as DEPLOY_SETTINGS
 
 from ..systemd import SystemdTasksMixin
@@ -37,9 +35,16 @@ class AppSettings(DeployComponentSettings):
         'systemd': {
             'template': 'app.service',
             'name': '{settings.NAME}_{instance}.service',
+            'mode': 'files',
             'boot': True,
             'type': 'simple',
             'instances': {'count': 0, 'percent': 0},
+            'socket': {
+                'template': 'app.socket',
+                'listen': '',
+                'backlog': 4096,
+                'reuseport': True
+            },
             'context': {
                 'limit_nofile': 2000,
                 'description': "Application description",
@@ -52,6 +57,14 @@ class AppSettings(DeployComponentSettings):
     def listen_private_ip(self):
         return self._data['listen_private_ip']
 
+    @property
+    def socket_activated(self):
+        return self.systemd.get('mode') == 'socket'
+
+    @property
+    def socket_listen(self):
+        return self.systemd['socket']['listen'].format(settings=self)
+
     @property
     def bin(self):
         bin_path = self._data['bin'].format(settings=self)
@@ -95,6 +108,8 @@ class AppTasks(DeployTasks, SystemdTasksMixin):
         ])
 
     async def _watch_and_sync_dir(self, dir_info, tasks):
+        from watchgod import awatch
+
         async for _ in awatch(dir_info['local']):
             with self._set_from_tasks(tasks):
                 await self._upload(
@@ -106,6 +121,7 @@ class AppTasks(DeployTasks, SystemdTasksMixin):
     async def _sync_roy_cache(self):
         await self._upload(DEPLOY_SETTINGS.settings_cache_file)
 
+    @incremental()
     async def build(self):
         """Define build instructions for your app"""
         await self._apt_install('rsync')
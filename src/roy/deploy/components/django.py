@@ -11,15 +11,26 @@ class DjangoSettings(PythonSettings):
     # TODO: add jinja2 render here not default format
     DEFAULT = update_dict_recur(PythonSettings.DEFAULT, {
         'bin':
-            "uvicorn --host {settings.listen_ip} "
-            "--port {settings.port} "
+            "uvicorn {settings.listen} "
             "--loop uvloop app.components.django.asgi:application "
             "--lifespan off --http httptools --no-access-log "
             "--log-level error",
         'port': 8000,
-        'user': 'django'
+        'user': 'django',
+        'systemd': {
+            'health': {'port': '{port}', 'timeout': 60}
+        }
     })
 
+    @property
+    def listen(self):
+        """Uvicorn listen options, socket inherited from systemd is
+        always passed as file descriptor 3, port is set per instance
+        by systemd unit."""
+        if self.socket_activated:
+            return '--fd 3'
+        return f'--host {self.listen_ip} --port ${{PORT}}'
+
 
 SETTINGS = DjangoSettings()
 
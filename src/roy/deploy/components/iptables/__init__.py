@@ -2,12 +2,11 @@
 from pathlib import Path
 from itertools import chain
 
-import jinja2
-
 from roy.utils.tasks import TaskRunError
 
-from ...tasks import DeployTasks, register
+from ...tasks import DeployTasks, incremental, register
 from ...settings import DeployComponentSettings
+from ...templates import get_template_from_string, read_template
 
 from ..systemd import SystemdTasksMixin
 
@@ -77,9 +76,11 @@ class IPtablesTasks(DeployTasks, SystemdTasksMixin):
         print(await self._run(f'cat {self.settings.rules_path}'))
 
     async def get_iptables_template(self):
-        return self.settings.custom_rules_template.read_text()
+        return read_template(self.settings.custom_rules_template)
 
     @register
+    @register.depends('*')
+    @incremental(inventory=True)
     async def sync(self):
         rendered = []
         access_hosts = []
@@ -93,8 +94,7 @@ class IPtablesTasks(DeployTasks, SystemdTasksMixin):
                 continue
             get_template = getattr(task, 'get_iptables_template', None)
             if get_template:
-                template = jinja2.Template(
-                    await get_template(), enable_async=True)
+                template = get_template_from_string(await get_template())
                 context = {'deploy': task, 'components': all_components}
                 rendered.append(await template.render_async(context))
 
@@ -120,6 +120,7 @@ class IPtablesTasks(DeployTasks, SystemdTasksMixin):
             pass
 
     @register
+    @register.depends('*')
     async def setup(self):
         await self._apt_install('rsync', 'iptables')
 
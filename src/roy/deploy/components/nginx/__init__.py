@@ -2,12 +2,17 @@ from pathlib import Path
 
 from roy.utils.tasks import register
 
-from ...tasks import DeployTasks, as_root
+from ...tasks import DeployTasks, as_root, fact, incremental
 from ...settings import DeployComponentSettings
+from ...templates import read_template
 
 from ..systemd import SystemdTasksMixin
 
 
+# integer value or 'auto' to derive it from host hardware
+AUTO = {'type': ['integer', 'string'], 'regex': 'auto'}
+
+
 class NginxSettings(DeployComponentSettings):
     NAME = 'nginx'
     SCHEMA = {
@@ -30,8 +35,42 @@ class NginxSettings(DeployComponentSettings):
             'required': False
         },
         'configs': {'type': 'dict'},
-        'connections': {'type': 'integer', 'required': True},
-        'workers': {'type': 'integer', 'required': True},
+        'connections': dict(AUTO, required=True),
+        'workers': dict(AUTO, required=True),
+        'rlimit_nofile': AUTO,
+        'cpu_affinity': {'type': 'boolean'},
+        'open_file_cache': {
+            'type': 'dict',
+            'schema': {
+                'max': AUTO,
+                'inactive': {'type': 'integer', 'min': 1}
+            }
+        },
+        'gzip': {
+            'type': 'dict',
+            'schema': {
+                'enabled': {'type': 'boolean'},
+                'level': AUTO,
+                'min_length': {'type': 'integer', 'min': 0},
+                'types': {'type': 'list', 'schema': {'type': 'string'}}
+            }
+        },
+        'brotli': {
+            'type': 'dict',
+            'schema': {
+                'enabled': {'type': 'boolean'},
+                'level': AUTO
+            }
+        },
+        'proxy': {
+            'type': 'dict',
+            'schema': {
+                'buffering': {'type': 'boolean'},
+                'buffer_size': {'type': 'string'},
+                'buffers': {'type': 'string'},
+                'busy_buffers_size': {'type': 'string'}
+            }
+        },
         'aio': {'type': 'boolean', 'required': True},
         'sendfile': {'type': 'boolean', 'required': True},
         'tcp_nopush': {'type': 'boolean', 'required': True},
@@ -47,6 +86,22 @@ class NginxSettings(DeployComponentSettings):
                 'v4': {'type': 'string', 'required': True}
             },
             'required': True
+        },
+        'upstreams': {
+            'type': 'dict',
+            'schema': {
+                'template': {'type': 'string'},
+                'name': {'type': 'string'},
+                'prefix': {'type': 'string'},
+                'proxy': {'type': 'string'},
+                'components': {'type': 'list', 'schema': {'type': 'string'}},
+                'balance': {'type': 'string'},
+                'keepalive': {'type': 'integer', 'min': 0},
+                'keepalive_requests': {'type': 'integer', 'min': 1},
+                'keepalive_timeout': {'type': 'integer', 'min': 1},
+                'max_fails': {'type': 'integer', 'min': 0},
+                'fail_timeout': {'type': 'integer', 'min': 0}
+            }
         }
     }
     DEFAULT = {
@@ -69,8 +124,29 @@ class NginxSettings(DeployComponentSettings):
             'geoip2': 'ngx_http_geoip2_module-master',
         },
         'configs': {'server.conf': 'nginx.conf'},
-        'connections': 1000,
-        'workers': 1,
+        'connections': 'auto',
+        'workers': 'auto',
+        'rlimit_nofile': 'auto',
+        'cpu_affinity': True,
+        'open_file_cache': {'max': 'auto', 'inactive': 60},
+        'gzip': {
+            'enabled': True,
+            'level': 'auto',
+            'min_length': 1024,
+            'types': [
+                'text/plain', 'text/css', 'text/xml', 'text/javascript',
+                'application/javascript', 'application/json',
+                'application/xml', 'image/svg+xml'
+            ]
+        },
+        # needs ngx_brotli module added to `packages`
+        'brotli': {'enabled': False, 'level': 'auto'},
+        'proxy': {
+            'buffering': True,
+            'buffer_size': 'auto',
+            'buffers': 'auto',
+            'busy_buffers_size': 'auto'
+        },
         'aio': True,
         'sendfile': True,
         'tcp_nopush': True,
@@ -80,7 +156,22 @@ class NginxSettings(DeployComponentSettings):
         'access_log': 'logs/access.log',
         'error_log': 'logs/error.log',
         'default_type': 'application/octet-stream',
-        'iptables': {'v4': 'ipv4.rules'}
+        'iptables': {'v4': 'ipv4.rules'},
+        'upstreams': {
+            'template': 'upstreams.conf',
+            'name': 'upstreams.conf',
+            # upstreams are named with prefix to not clash with apps
+            # configs, locations proxying to them include `proxy`
+            'prefix': 'roy_',
+            'proxy': 'upstreams.params',
+            'components': ['app', 'python', 'django'],
+            'balance': 'least_conn',
+            'keepalive': 32,
+            'keepalive_requests': 1000,
+            'keepalive_timeout': 60,
+            'max_fails': 3,
+            'fail_timeout': 10
+        }
     }
 
     @property
@@ -155,9 +246,88 @@ class NginxSettings(DeployComponentSettings):
     def master(self):
         return self._data['master']
 
+    def tune(
+            self, cores: int, memory: int, nofile: int,
+            file_max: int) -> dict:
+        """Resolve 'auto' values for host with `cores`, `memory` in kB
+        and open files limits, explicitly set values are kept.
+
+        >>> tuning = SETTINGS.tune(8, 16 * 1024 ** 2, 1048576, 1600000)
+        >>> tuning['workers'], tuning['rlimit_nofile']
+        (8, 100000)
+        >>> tuning['connections'], tuning['gzip']['level']
+        (4096, 5)
+        """
+        def auto(value, default):
+            return default if value == 'auto' else value
+
+        data = self._data
+        workers = max(auto(data['workers'], cores), 1)
+        rlimit_nofile = auto(
+            data.get('rlimit_nofile', 'auto'),
+            max(min(nofile, file_max // (2 * workers)), 1024)
+        )
+        # proxied request keeps client and upstream connections and
+        # buffers, give all workers half of memory by 256kB each
+        connections = auto(data['connections'], max(min(
+            rlimit_nofile // 2, memory // 2 // 256 // workers), 1024))
+        large = memory >= 4 * 1024 ** 2
+        buffer_size = '16k' if large else '8k'
+        proxy = {
+            'buffering': True, 'buffer_size': buffer_size,
+            'buffers': f'{16 if large else 8} {buffer_size}',
+            'busy_buffers_size': '32k' if large else '16k'
+        }
+        proxy.update({
+            key: value
+            for key, value in data.get('proxy', {}).items()
+            if value != 'auto'
+        })
+        open_file_cache = data.get('open_file_cache', {})
+        gzip = data.get('gzip', {})
+        brotli = data.get('brotli', {})
+        return {
+            'workers': workers,
+            'cpu_affinity': data.get('cpu_affinity', True) and workers > 1,
+            'rlimit_nofile': rlimit_nofile,
+            'connections': connections,
+            'open_file_cache': {
+                'max': auto(
+                    open_file_cache.get('max', 'auto'),
+                    min(connections * workers, 200000)),
+                'inactive': open_file_cache.get('inactive', 60)
+            },
+            'gzip': dict(
+                gzip, level=auto(gzip.get('level', 'auto'),
+                                 5 if cores >= 4 else 3)),
+            'brotli': dict(
+                brotli, level=auto(brotli.get('level', 'auto'),
+                                   5 if cores >= 4 else 4)),
+            'proxy': proxy
+        }
+
+    @property
+    def upstreams(self):
+        return self._data['upstreams']
+
+    @property
+    def upstreams_template(self):
+        template = self.upstreams['template']
+        if not template.startswith('/'):
+            return (self.local_root / template).resolve()
+        return Path(template)
+
+    @property
+    def upstreams_proxy(self):
+        """Proxy params for upstream keepalive, nginx inherits
+        `proxy_set_header` only to location without own ones, so
+        locations include this file."""
+        return self.include.parent / self.upstreams['proxy']
+
     @property
     def iptables_v4_rules(self):
-        return (self.local_root / self._data['iptables']['v4']).read_text()
+        return read_template(
+            self.local_root / self._data['iptables']['v4'])
 
 
 SETTINGS = NginxSettings()
@@ -169,7 +339,44 @@ class NginxTasks(DeployTasks, SystemdTasksMixin):
     async def get_iptables_template(self):
         return self.settings.iptables_v4_rules
 
+    @fact
+    async def _get_hardware(self) -> dict:
+        """Host cpu cores, memory in kB and open files limits."""
+        output = await self._run(
+            'nproc --all; grep MemTotal /proc/meminfo; '
+            'ulimit -Hn; cat /proc/sys/fs/file-max')
+        cores, memory, nofile, file_max = output.split('\n')[:4]
+        file_max = int(file_max)
+        return {
+            'cores': int(cores),
+            'memory': int(memory.split()[1]),
+            'nofile': file_max if nofile == 'unlimited' else int(nofile),
+            'file_max': file_max
+        }
+
+    async def _get_upstreams(self) -> list:
+        """Upstream per component with servers from all inventory
+        hosts, instances count is used as server weight."""
+        prefix = self.settings.upstreams['prefix']
+        upstreams = []
+        for name in self.settings.upstreams['components']:
+            servers = {}
+            for task in self.get_all_manager_tasks(name):
+                get_servers = getattr(
+                    task, 'get_nginx_upstream_servers', None)
+                if get_servers is None:
+                    continue
+                for address, weight in await get_servers():
+                    servers[address] = servers.get(address, 0) + weight
+            if servers:
+                upstreams.append({
+                    'name': f'{prefix}{name}',
+                    'servers': sorted(servers.items())
+                })
+        return upstreams
+
     @register
+    @incremental()
     async def build(self):
         if not self.settings.master:
             print('Nginx already builded on this host, just use nginx.sync')
@@ -184,31 +391,58 @@ class NginxTasks(DeployTasks, SystemdTasksMixin):
             'libxslt1-dev', 'rsync'
         )
 
-        async with self._cd(self.settings.build, temporary=True):
-            for package, url in self.settings.packages.items():
-                await self._download_and_unpack(
-                    url, Path('.', package),
-                    archive_dir_name=self.settings.packages_dir.get(package)
-                )
+        build_command = (
+            f"./configure --prefix={self.settings.root_abs} "
+            f"--user='{self.user}' --group='{self.user}' "
+            "--with-pcre=../pcre "
+            "--with-pcre-jit --with-zlib=../zlib "
+            "--with-openssl=../openssl --with-http_ssl_module "
+            "--with-http_v2_module --with-threads "
+            "--with-file-aio --with-http_realip_module "
+        )
 
-            async with self._cd('nginx'):
-                build_command = (
-                    f"./configure --prefix={self.settings.root_abs} "
-                    f"--user='{self.user}' --group='{self.user}' "
-                    "--with-pcre=../pcre "
-                    "--with-pcre-jit --with-zlib=../zlib "
-                    "--with-openssl=../openssl --with-http_ssl_module "
-                    "--with-http_v2_module --with-threads "
-                    "--with-file-aio --with-http_realip_module "
-                )
-                await self._run(build_command)
-                await self._run('make -j$(nproc)')
-                await self._run('make install')
+        async def build():
+            async with self._cd(self.settings.build, temporary=True):
+                for package, url in self.settings.packages.items():
+                    await self._download_and_unpack(
+                        url, Path('.', package),
+                        archive_dir_name=self.settings.packages_dir.get(
+                            package)
+                    )
+
+                async with self._cd('nginx'):
+                    await self._run(build_command, stream=True)
+                    await self._run('make -j$(nproc)', stream=True)
+                    await self._run('make install')
+
+        include_dir = self.settings.include.parent.relative_to(
+            self.settings.root_abs)
+        await self._cached_build(
+            self.settings.NAME, self.settings.root_abs, build,
+            exclude=['logs', include_dir],
+            packages=self.settings.packages,
+            packages_dir=self.settings.packages_dir,
+            configure=build_command
+        )
 
     @register
+    @register.depends('app.*', 'python.*', 'django.*')
+    @incremental(inventory=True)
     async def sync(self):
+        upstreams = await self._get_upstreams()
+        tuning = self.settings.tune(**await self._get_hardware())
+        context = {'upstreams': upstreams, 'tuning': tuning}
         for template, path in self.settings.configs:
-            await self._upload_template(template, path)
+            await self._upload_template(template, path, context.copy())
+        await self._upload_template(
+            self.settings.upstreams_template,
+            self.settings.include.parent / self.settings.upstreams['name'],
+            context.copy()
+        )
+        await self._upload_template(
+            self.settings.local_root / 'upstreams.params',
+            self.settings.upstreams_proxy, context.copy()
+        )
 
         # nginx configs from other projects
         for task in self.get_all_manager_tasks():
@@ -221,12 +455,17 @@ class NginxTasks(DeployTasks, SystemdTasksMixin):
                 await self._upload_template(
                     template,
                     self.settings.root / self.settings.include.parent
-                    / path, {'deploy': task, 'nginx_deploy': self}
+                    / path, {
+                        'deploy': task, 'nginx_deploy': self,
+                        'tuning': tuning, 'upstreams': upstreams,
+                        'upstreams_proxy': self.settings.upstreams_proxy
+                    }
                 )
 
         await self._sync_systemd_units()
 
     @register
+    @register.depends('app.*', 'python.*', 'django.*')
     async def setup(self):
         await self.build()
         await self.sync()
@@ -3,8 +3,9 @@ from pathlib import Path
 from roy.utils.tasks import TaskRunError
 
 from roy.deploy.tasks import (
-    DeployComponentSettings, DeployTasks, register
+    DeployComponentSettings, DeployTasks, incremental, register
 )
+from roy.deploy.templates import read_template
 from roy.deploy.components.systemd import SystemdTasksMixin
 
 
@@ -116,7 +117,8 @@ class PostgresSettings(DeployComponentSettings):
 
     @property
     def iptables_v4_rules(self):
-        return (self.local_root / self._data['iptables']['v4']).read_text()
+        return read_template(
+            self.local_root / self._data['iptables']['v4'])
 
     @property
     def listen_private_ip(self):
@@ -133,6 +135,7 @@ class PostgresTasks(DeployTasks, SystemdTasksMixin):
         return self.settings.iptables_v4_rules
 
     @register
+    @incremental()
     async def build(self):
         await self._create_user()
 
@@ -141,28 +144,40 @@ class PostgresTasks(DeployTasks, SystemdTasksMixin):
             'zlib1g-dev', 'libossp-uuid-dev', 'libsystemd-dev',
             'rsync'
         )
-        async with self._cd(self.settings.build_dir, temporary=True):
-            for package, url in self.settings.sources.items():
-                await self._download_and_unpack(url, Path('.', package))
-            async with self._cd('postgres'):
-                await self._run(
-                    f'./configure --with-systemd '
-                    f'--prefix={self.settings.root_abs}'
-                )
-
-                async with self._cd('contrib'):
-                    await self._run('make')
-
-                # TODO: add custom contrib packages configuration
-                # for contrib in str(await self._run('ls contrib')).split():
-                #     if contrib
-                #     async with self._cd(f'contrib/{contrib}'):
-                #         await self._run('ls')
-
-                await self._run('make -j$(nproc)')
-                await self._run('make install')
+        configure = (
+            f'./configure --with-systemd '
+            f'--prefix={self.settings.root_abs}'
+        )
+
+        async def build():
+            async with self._cd(self.settings.build_dir, temporary=True):
+                for package, url in self.settings.sources.items():
+                    await self._download_and_unpack(url, Path('.', package))
+                async with self._cd('postgres'):
+                    await self._run(configure, stream=True)
+
+                    async with self._cd('contrib'):
+                        await self._run('make', stream=True)
+
+                    # TODO: add custom contrib packages configuration
+                    # for contrib in str(
+                    #         await self._run('ls contrib')).split():
+                    #     if contrib
+                    #     async with self._cd(f'contrib/{contrib}'):
+                    #         await self._run('ls')
+
+                    await self._run('make -j$(nproc)', stream=True)
+                    await self._run('make install')
+
+        await self._cached_build(
+            self.settings.NAME, self.settings.root_abs, build,
+            exclude=[self.settings.data_dir.relative_to(
+                self.settings.root_abs)],
+            sources=self.settings.sources, configure=configure
+        )
 
     @register
+    @incremental(inventory=True)
     async def sync(self):
         for name, config_path in self.settings.configs:
             await self._upload_template(
@@ -1,7 +1,7 @@
 from pathlib import Path
 
 from roy.utils.collections import update_dict_recur
-from roy.deploy.tasks import onehost, register
+from roy.deploy.tasks import incremental, onehost, register
 
 from .app import AppTasks, AppSettings
 
@@ -33,7 +33,8 @@ class PythonSettings(AppSettings):
         'systemd': {
             'default_config': [
                 'Environment=PYTHONPATH={settings.home_abs}'
-            ]
+            ],
+            'socket': {'listen': '{settings.listen_ip}:{settings.port}'}
         }
     })
 
@@ -72,6 +73,27 @@ class PythonSettings(AppSettings):
     def port(self):
         return self._data.get('port', 8000)
 
+    @property
+    def listens(self) -> bool:
+        """Only app with `port` set serves connections, plain python
+        scripts never listen."""
+        return 'port' in self._data
+
+    def instance_port(self, instance) -> int:
+        """Each instance listens on own port starting from `port`, in
+        'socket' mode all instances share one socket."""
+        if self.socket_activated or not isinstance(instance, int):
+            return self.port
+        return self.port + instance - 1
+
+    @property
+    def upstream(self):
+        """Address for nginx proxy, in 'socket' mode all instances
+        accept on one shared socket."""
+        if self.socket_activated:
+            return self.socket_listen
+        return f'{self.listen_ip}:{self.port}'
+
     @property
     def watch_dirs(self):
         watch_dirs = super().watch_dirs
@@ -93,6 +115,29 @@ SETTINGS = PythonSettings()
 class PythonTasks(AppTasks):
     SETTINGS = PythonSettings
 
+    def _get_instance_context(self, instance) -> dict:
+        return {'port': self.settings.instance_port(instance)}
+
+    def _get_instance_environment(self, instance) -> dict:
+        if self.settings.socket_activated:
+            return {}
+        return {'PORT': self.settings.instance_port(instance)}
+
+    async def get_nginx_upstream_servers(self):
+        """Upstream servers as (address, weight), socket activated
+        instances share one listener weighted by their count."""
+        if not self.settings.listens:
+            return []
+        count = await self._calc_instances_count(
+            **self.settings.systemd['instances'])
+        ip = self.settings.listen_ip or self.private_ip
+        if self.settings.socket_activated:
+            return [(self.settings.upstream, count)]
+        return [
+            (f'{ip}:{self.settings.instance_port(instance)}', 1)
+            for instance in range(1, count + 1)
+        ]
+
     @register
     async def pip(self, command: str):
         return await self.run(f'pip3 {command}')
@@ -152,7 +197,8 @@ class PythonTasks(AppTasks):
             return
         await self._local('rm -rf ./build ./dist')
         await self._local('pip install -e .')
-        await self._local('python setup.py sdist bdist_wheel')
+        await self._local(
+            'python setup.py sdist bdist_wheel', stream=True)
 
     @register.after(install)
     @register.after(setup)
@@ -160,6 +206,7 @@ class PythonTasks(AppTasks):
         await self._local('rm -rf ./build ./dist')
 
     @register
+    @incremental()
     async def build(self):
         await super().build()
 
@@ -175,26 +222,31 @@ class PythonTasks(AppTasks):
         )
         await self._mkdir(self.settings.root, delete=True)
 
-        async with self._cd(build_path, temporary=True):
-            url = 'https://www.python.org/ftp/' \
-                f'python/{version}/Python-{version}.tar.xz'
-            await self._download_and_unpack(url)
-
-            await self._run(
-                './configure --prefix={0} '
-                '--enable-loadable-sqlite-extensions --enable-shared '
-                '--with-system-expat --with-system-ffi '
-                '--with-ensurepip '
-                'LDFLAGS="-L{0}/extlib/lib -Wl,--rpath={0}/lib '
-                '-Wl,--rpath={0}/extlib/lib" '
-                'CFLAGS="-I{0}/extlib/include -O3"'.format(
-                    self.settings.root_abs
-                )
-            )
-            await self._run('make -j$(nproc) {}'.format(
-                '' if fast_build else 'profile-opt'))
-            await self._run('make install > /dev/null')
-
-        await self.pip('install wheel')
-        await self.pip('install -U pip')
-        await self.pip('install -U setuptools')
+        url = 'https://www.python.org/ftp/' \
+            f'python/{version}/Python-{version}.tar.xz'
+        configure = (
+            './configure --prefix={0} '
+            '--enable-loadable-sqlite-extensions --enable-shared '
+            '--with-system-expat --with-system-ffi '
+            '--with-ensurepip '
+            'LDFLAGS="-L{0}/extlib/lib -Wl,--rpath={0}/lib '
+            '-Wl,--rpath={0}/extlib/lib" '
+            'CFLAGS="-I{0}/extlib/include -O3"'.format(self.settings.root_abs)
+        )
+        make = 'make -j$(nproc) {}'.format('' if fast_build else 'profile-opt')
+
+        async def build():
+            async with self._cd(build_path, temporary=True):
+                await self._download_and_unpack(url)
+                await self._run(configure, stream=True)
+                await self._run(make, stream=True)
+                await self._run('make install > /dev/null')
+
+            await self.pip('install wheel')
+            await self.pip('install -U pip')
+            await self.pip('install -U setuptools')
+
+        await self._cached_build(
+            self.settings.NAME, self.settings.root_abs, build,
+            url=url, configure=configure, make=make
+        )
@@ -2,8 +2,9 @@ from pathlib import Path
 
 from roy.utils.tasks import register
 
-from ...tasks import DeployTasks
+from ...tasks import DeployTasks, incremental
 from ...settings import DeployComponentSettings
+from ...templates import read_template
 
 from ..systemd import SystemdTasksMixin
 
@@ -111,7 +112,8 @@ class RedisSettings(DeployComponentSettings):
 
     @property
     def iptables_v4_rules(self):
-        return (self.local_root / self._data['iptables']['v4']).read_text()
+        return read_template(
+            self.local_root / self._data['iptables']['v4'])
 
     @property
     def listen_private_ip(self):
@@ -136,6 +138,7 @@ class RedisTasks(DeployTasks, SystemdTasksMixin):
         ))
 
     @register
+    @incremental()
     async def build(self):
         await self._apt_install(
             'build-essential', 'sysfsutils', 'libsystemd-dev',
@@ -144,30 +147,40 @@ class RedisTasks(DeployTasks, SystemdTasksMixin):
         await self._create_user()
 
         with self._set_user('root'):
-            await self._run(
-                'echo "kernel/mm/transparent_hugepage/enabled = never" '
-                '>> /etc/sysfs.conf'
-            )
-            await self._run(
-                'echo "vm.overcommit_memory=1" >> /etc/sysctl.conf')
-            await self._run(
-                'echo "net.core.somaxconn=65535" >> /etc/sysctl.conf')
-            await self._run('echo "fs.file-max=100000" >> /etc/sysctl.conf')
-            await self._run('sysctl -p')
-            await self._run('systemctl force-reload sysfsutils')
-
-        async with self._cd(self.settings.build_dir, temporary=True):
-            for package, url in self.settings.packages.items():
-                await self._download_and_unpack(url, Path('.', package))
-
-            async with self._cd('redis'):
-                await self._run('make distclean')
+            async with self._batch():
                 await self._run(
-                    "make -j$(nproc) USE_SYSTEMD=yes MALLOC=jemalloc")
+                    'echo "kernel/mm/transparent_hugepage/enabled = never" '
+                    '>> /etc/sysfs.conf'
+                )
                 await self._run(
-                    f"make PREFIX={self.settings.root_abs} install")
+                    'echo "vm.overcommit_memory=1" >> /etc/sysctl.conf')
+                await self._run(
+                    'echo "net.core.somaxconn=65535" >> /etc/sysctl.conf')
+                await self._run(
+                    'echo "fs.file-max=100000" >> /etc/sysctl.conf')
+                await self._run('sysctl -p')
+                await self._run('systemctl force-reload sysfsutils')
+
+        make = "make -j$(nproc) USE_SYSTEMD=yes MALLOC=jemalloc"
+
+        async def build():
+            async with self._cd(self.settings.build_dir, temporary=True):
+                for package, url in self.settings.packages.items():
+                    await self._download_and_unpack(url, Path('.', package))
+
+                async with self._cd('redis'):
+                    await self._run('make distclean')
+                    await self._run(make, stream=True)
+                    await self._run(
+                        f"make PREFIX={self.settings.root_abs} install")
+
+        await self._cached_build(
+            self.settings.NAME, self.settings.bin.parent, build,
+            packages=self.settings.packages, make=make
+        )
 
     @register
+    @incremental(inventory=True)
     async def sync(self):
         await self._upload_template(
             self.settings.config_template, self.settings.config_path)
@@ -1,6 +1,12 @@
+import asyncio
+import shlex
+
 from pathlib import Path
 
-from roy.utils.tasks import register, TaskRunError
+from roy.utils.tasks import register
+
+from ..tasks import rolling
+from ..templates import get_template
 
 
 class SystemdTasksMixin:
@@ -9,6 +15,9 @@ class SystemdTasksMixin:
         'schema': {
             'template': {'type': 'string'},
             'name': {'type': 'string'},
+            'mode': {
+                'type': 'string', 'allowed': ['files', 'template', 'socket']
+            },
             'boot': {'type': 'boolean'},
             'type': {'type': 'string'},
             'default_config': {
@@ -36,78 +45,271 @@ class SystemdTasksMixin:
                     'limit_nofile': {'type': 'integer'},
                     'description': {'type': 'string'}
                 }
+            },
+            'socket': {
+                'type': 'dict',
+                'schema': {
+                    'template': {'type': 'string'},
+                    'listen': {'type': 'string'},
+                    'backlog': {'type': 'integer', 'min': 1},
+                    'reuseport': {'type': 'boolean'}
+                }
+            },
+            'health': {
+                'type': 'dict',
+                'schema': {
+                    'host': {'type': 'string'},
+                    'port': {'type': ['integer', 'string']},
+                    'url': {'type': 'string'},
+                    'timeout': {'type': 'number', 'min': 0},
+                    'interval': {'type': 'number', 'min': 0}
+                }
             }
         }
     }
 
+    @property
+    def _is_template_mode(self):
+        return self.settings.systemd.get('mode', 'files') in (
+            'template', 'socket')
+
+    @property
+    def _systemd_socket(self) -> str:
+        """Socket unit shared by all instances in 'socket' mode."""
+        if self.settings.systemd.get('mode', 'files') != 'socket':
+            return ''
+        return f'{self.settings.NAME}.socket'
+
+    @staticmethod
+    def _is_template_instance(unit: Path) -> bool:
+        return '@' in unit.name and not unit.name.endswith('@.service')
+
     async def _get_systemd_services(self):
+        """Yield service per instance, in 'template' mode all instances
+        share one `name@.service` unit file."""
         systemd = self.settings.systemd
         name = systemd['name']
         count = await self._calc_instances_count(**systemd['instances'])
         for instance in range(1, count + 1):
             service = systemd.copy()
-            service['name'] = name.format(
-                settings=self.settings, deploy=self, instance=instance)
+            if self._is_template_mode:
+                service['name'] = f'{self.settings.NAME}@{instance}.service'
+                service['unit'] = f'{self.settings.NAME}@.service'
+            else:
+                service['name'] = service['unit'] = name.format(
+                    settings=self.settings, deploy=self, instance=instance)
             service['instance'] = instance
             yield service
 
+    async def _render_systemd_unit(self, service) -> str:
+        # template unit gets instance number from systemd specifier
+        instance = service['instance']
+        if service['unit'] != service['name']:
+            instance = '%i'
+        bin_ = str(self.settings.bin).format(
+            instance=instance, deploy=self, settings=self.settings
+        )
+        environment = {}
+        if instance != '%i':
+            environment = self._get_instance_environment(instance)
+        context = {
+            'instance': instance, 'bin': bin_,
+            'socket': self._systemd_socket, 'environment': environment
+        }
+        context.update(self._get_instance_context(instance))
+        context.update(service.get('context', {}))
+        return await self._render_systemd_template(
+            service['template'], context)
+
+    def _get_instance_context(self, instance) -> dict:
+        """Extra instance values for unit templates and health checks."""
+        return {}
+
+    def _get_instance_environment(self, instance) -> dict:
+        """Environment of instance process, template units get it from
+        per instance drop-in."""
+        return {}
+
+    def _render_systemd_dropin(self, service) -> str:
+        environment = self._get_instance_environment(service['instance'])
+        if not environment:
+            return ''
+        return '[Service]\n' + ''.join(
+            f'Environment={key}={value}\n'
+            for key, value in environment.items()
+        )
+
+    async def _render_systemd_socket(self) -> str:
+        """Socket unit activates first instance on incoming connection,
+        every instance sets `Sockets=` and is started explicitly."""
+        socket = self.settings.systemd['socket']
+        listen = socket.get('listen', '').format(
+            deploy=self, settings=self.settings)
+        if not listen:
+            raise ValueError(
+                f'Provide systemd.socket.listen for {self.settings.NAME}')
+        context = {
+            'listen': listen,
+            'service': f'{self.settings.NAME}@1.service',
+            'backlog': socket.get('backlog', 4096),
+            'reuseport': socket.get('reuseport', True)
+        }
+        context.update(self.settings.systemd.get('context', {}))
+        return await self._render_systemd_template(
+            socket['template'], context)
+
+    async def _render_systemd_template(self, template, context) -> str:
+        context.setdefault('deploy', self)
+        context.setdefault('settings', self.settings)
+        path = Path(template)
+        if not str(path).startswith('/'):
+            path = (self.settings.local_root / template)
+            path = path.resolve()
+        return await get_template(path).render_async(context)
+
     async def _sync_systemd_units(self):
         """Sync systemd units, delete old once if we changed
-        template or count."""
+        template or count. Units are rendered concurrently and only
+        changed ones are uploaded in one archive, in 'template' mode
+        only added or removed instances are started or stopped and
+        instance environment is set by drop-in. In 'socket' mode all
+        instances share one listening socket unit."""
         name = self.settings.NAME
+        systemd_dir = self.settings.systemd_dir
         systemd_cached_file = Path(f"~/.{name}_systemd_services")
-        try:
-            old_units = await self._run(f"cat {systemd_cached_file}")
-            old_units = {Path(s) for s in old_units.split('\n')}
-        except TaskRunError:
-            old_units = set()
+        old_units = await self._run(
+            f"cat {systemd_cached_file} 2> /dev/null || true")
+        old_units = {Path(s) for s in old_units.split('\n') if s}
 
         services = [service async for service in self._get_systemd_services()]
-        new_units = {self.settings.systemd_dir / s['name'] for s in services}
-
-        delete_units = old_units - new_units
-        if delete_units:
-            with self._set_user('root'):
-                names = ' '.join(u.name for u in delete_units)
-                await self._run(f'systemctl disable {names}')
-                await self._rmrf(' '.join(str(u) for u in delete_units))
-            await self._rmrf(systemd_cached_file)
-
+        files = {
+            systemd_dir / service['unit']: service for service in services
+        }
+        contents = await asyncio.gather(*[
+            self._render_systemd_unit(service) for service in files.values()
+        ])
+        units = [systemd_dir / s['name'] for s in services]
+        units += [path for path in files if path not in units]
+        files = dict(zip(files, contents))
         for service in services:
-            service_path = self.settings.systemd_dir / service['name']
-            bin_ = str(self.settings.bin).format(
-                instance=service['instance'], deploy=self, settings=self.settings
-            )
-            context = {'instance': service['instance'], 'bin': bin_}.copy()
-            context.update(service.get('context', {}))
-            path = Path(service['template'])
-            if not str(path).startswith('/'):
-                path = (self.settings.local_root / service['template'])
-                path = path.resolve()
+            if service['unit'] == service['name']:
+                continue
+            dropin = self._render_systemd_dropin(service)
+            if dropin:
+                path = systemd_dir / f"{service['name']}.d" / 'instance.conf'
+                files[path] = dropin
+                units.append(path)
+        socket = self._systemd_socket
+        if socket:
+            files[systemd_dir / socket] = await self._render_systemd_socket()
+            units.append(systemd_dir / socket)
 
-            with self._set_user('root'):
-                await self._upload_template(path, service_path, context)
+        with self._set_user('root'):
+            changed = await self._get_changed_files(files)
 
-            await self._run(f'echo "{service_path}" >> {systemd_cached_file}')
+        delete_units = old_units - set(units)
+        delete_files = [
+            unit for unit in delete_units
+            if not self._is_template_instance(unit)
+        ]
+        # scale up running template instances without touching others
+        added_units = []
+        if self._is_template_mode and old_units:
+            added_units = [
+                unit for unit in units
+                if unit not in old_units and unit not in files
+            ]
+        async with self._batch():
+            with self._set_user('root'):
+                names = ' '.join(
+                    u.name for u in delete_units
+                    if u.suffix in ('.service', '.socket') and
+                    not u.name.endswith('@.service'))
+                if names:
+                    await self._run(f'systemctl disable --now {names}')
+                if delete_files:
+                    await self._rmrf(' '.join(str(u) for u in delete_files))
+                await self._upload_archive(changed)
+                if changed or delete_files:
+                    await self._run('systemctl daemon-reload')
+                await self._systemctl('enable', boot_only=True)
+                # running instances keep listening on inherited socket
+                if socket and systemd_dir / socket in changed and \
+                        systemd_dir / socket in old_units:
+                    await self._run(f'systemctl restart {socket}')
+                if added_units:
+                    names = ' '.join(unit.name for unit in added_units)
+                    await self._run(f'systemctl start {names}')
 
-        with self._set_user('root'):
-            await self._run('systemctl daemon-reload')
-            await self._systemctl('enable', boot_only=True)
+            if old_units != set(units):
+                listing = ' '.join(shlex.quote(str(unit)) for unit in units)
+                await self._run(
+                    f"printf '%s\\n' {listing} > {systemd_cached_file}.tmp && "
+                    f"mv {systemd_cached_file}.tmp {systemd_cached_file}"
+                )
 
-    async def _systemctl(
-            self, command: str, display=False, boot_only=False):
-        results = []
+    async def _get_managed_services(self, boot_only=False):
         async for service in self._get_systemd_services():
             if 'manage' in service and not service['manage']:
                 continue
             if boot_only and not service.get('boot', False):
                 continue
+            yield service
 
-            with self._set_user('root'):
-                result = await self._run(
-                    f'systemctl {command} {service["name"]}')
-            results.append(result)
-        return results
+    async def _systemctl(
+            self, command: str, display=False, boot_only=False):
+        """Run systemctl command once for all managed units, shared
+        socket is kept open on restart to not drop connections."""
+        names = [
+            service['name']
+            async for service in self._get_managed_services(boot_only)
+        ]
+        if names and self._systemd_socket and command != 'restart':
+            names.append(self._systemd_socket)
+        if not names:
+            return []
+        with self._set_user('root'):
+            return [await self._run(f"systemctl {command} {' '.join(names)}")]
+
+    def _get_health(self, service) -> dict:
+        """Health gate settings, empty if there is nothing to check. In
+        'socket' mode systemd keeps port open while instance restarts,
+        so only `url` check is used."""
+        health = dict(service.get('health', {}))
+        if self._systemd_socket:
+            health.pop('port', None)
+        if not health.get('port') and not health.get('url'):
+            return {}
+        return health
+
+    async def _wait_healthy(self, service):
+        """Wait until instance port accepts connections or url responds
+        successfully, configured by `systemd.health` settings."""
+        health = self._get_health(service)
+        if not health:
+            return
+
+        context = {
+            'settings': self.settings, 'deploy': self,
+            'instance': service['instance']
+        }
+        context.update(self._get_instance_context(service['instance']))
+        if health.get('url'):
+            check = "wget -q -O /dev/null '{}'".format(
+                health['url'].format(**context))
+        else:
+            host = health.get('host', '{settings.listen_ip}')
+            check = '(exec 3<>/dev/tcp/{}/{})'.format(
+                host.format(**context), str(health['port']).format(**context))
+
+        timeout = health.get('timeout', 60)
+        interval = health.get('interval', 1)
+        await self._run(
+            f'timeout {timeout} bash -c '
+            f'"until {check} 2> /dev/null; do sleep {interval}; done" || '
+            f'(echo "{service["name"]} is not healthy after {timeout}s" >&2;'
+            ' exit 1)'
+        )
 
     @register
     async def start(self):
@@ -118,8 +320,18 @@ class SystemdTasksMixin:
         await self._systemctl('stop')
 
     @register
+    @rolling
     async def restart(self):
-        await self._systemctl('restart')
+        """Restart all instances at once or, with health check, one by
+        one waiting until previous instance is healthy."""
+        if not self._get_health(self.settings.systemd):
+            await self._systemctl('restart')
+            return
+
+        async for service in self._get_managed_services():
+            with self._set_user('root'):
+                await self._run(f'systemctl restart {service["name"]}')
+            await self._wait_healthy(service)
 
     @register
     async def status(self):
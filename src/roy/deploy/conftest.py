@@ -0,0 +1,15 @@
+import pytest
+
+from roy.deploy.settings import SETTINGS
+from roy.deploy.templates import get_environment
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep deploy caches of tests out of user home."""
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setitem(
+        SETTINGS._data, 'cache', dict(SETTINGS.cache, dir=str(cache_dir)))
+    get_environment.cache_clear()
+    yield cache_dir
+    get_environment.cache_clear()
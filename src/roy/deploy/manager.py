@@ -1,12 +1,16 @@
+import sys
 import json
+import math
 import asyncio
 
 from contextlib import contextmanager, asynccontextmanager
 
-from roy.utils.tasks import TasksManager, register
+from roy.utils.tasks import TasksManager, TaskRunError, register
 
+from .ssh import TRANSPORTS
 from .settings import SETTINGS
 from .tasks import DeployTasks
+from .providers import StaticProvider
 
 
 class DeployTasksManager(TasksManager):
@@ -16,15 +20,31 @@ class DeployTasksManager(TasksManager):
         self.debug = False
         self.override = False
         self.hosts = {}
+        ssh_settings = SETTINGS.ssh.copy()
+        transport_class = TRANSPORTS[ssh_settings.pop('transport')]
+        self.transport = transport_class(**ssh_settings)
+        self.concurrency = SETTINGS.concurrency['global']
+        self.host_concurrency = SETTINGS.concurrency['host']
+        self.task_timeout = SETTINGS.timeouts['task']
+        self.command_timeout = SETTINGS.timeouts['command']
+        self.retries = SETTINGS.retries
+        self.rolling = SETTINGS.rolling
+        self.artifacts = set()
+        self.uploads = {}
+        self.facts = {}
+        self._lock = None
+        self._locks = {}
+        self._host_semaphores = {}
         self.nohost = {
             'user': '__nohost__',
             'public_ip': None, 'private_ip': None, 'ssh_port': 22
         }
 
+        self.tasks.loaders.update(SETTINGS.tasks_loaders)
         for class_ in SETTINGS.tasks_classes:
             self.register(class_)
 
-    def run(self, *commands):
+    async def run_async(self, *commands):
         commands = list(commands)
         if '-f' in commands:
             commands.remove('-f')
@@ -36,45 +56,107 @@ class DeployTasksManager(TasksManager):
         elif old_hosts_file.exists():
             old_hosts = json.loads(old_hosts_file.read_text())
 
-        for provider_class in SETTINGS.provider_classes:
+        for provider_class in SETTINGS.provider_classes or [StaticProvider]:
             settings = SETTINGS.providers.get(provider_class.NAME, {})
             provider = provider_class(
                 self, SETTINGS.hosts, old_hosts, settings)
-            self.hosts.update(asyncio.run(provider.initialize()))
+            self.hosts.update(await provider.initialize())
 
         SETTINGS.settings_cache_file.write_text(
             json.dumps(self.hosts, indent=2))
-        super().run(*commands)
 
-    def run_hooks(self, task_class, name, hook_name, instance=None):
-        instance = task_class(self, None, self.nohost)
-        super().run_hooks(task_class, name, hook_name, instance=instance)
-
-    def run_task(self, task_class, name, args):
+        self.uploads = {}
+        self.facts = {}
+        self._lock = asyncio.Lock()
+        self._locks = {}
+        self._host_semaphores = {}
+        try:
+            return await super().run_async(*commands)
+        finally:
+            await self.transport.close()
+            if self.debug:
+                stats = self.transport.stats
+                print(
+                    f"[ssh] opens: {stats['opens']}, "
+                    f"reuses: {stats['reuses']}, bytes: {stats['bytes']}"
+                )
+
+    async def run_hooks(self, task_class, name, hook_name, instance=None):
+        instance = task_class(self, self._lock, self.nohost)
+        await super().run_hooks(
+            task_class, name, hook_name, instance=instance)
+
+    def get_lock(self, key):
+        """Lock by key shared between all tasks of current run."""
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def _get_host_semaphore(self, host):
+        key = host['public_ip']
+        if key not in self._host_semaphores:
+            limit = self.host_concurrency if key else 0
+            self._host_semaphores[key] = asyncio.Semaphore(
+                limit or sys.maxsize)
+        return self._host_semaphores[key]
+
+    async def run_task(self, task_class, name, args):
         if not issubclass(task_class, DeployTasks):
-            return super().run_task(task_class, name, args)
-
-        current_hosts = self._prepare_hosts(task_class, name)
-
-        async def run():
-            lock = asyncio.Lock()
-            grouped_tasks = []
-            for host in current_hosts:
-                task = getattr(task_class(self, lock, host), name)
-                key = host['public_ip']
-                task_added = False
-                for group in grouped_tasks:
-                    if key not in group:
-                        group[key] = task
-                        task_added = True
-                        break
-                if not task_added:
-                    grouped_tasks.append({key: task})
-
-            for tasks in grouped_tasks:
-                await asyncio.gather(*[task(*args) for task in tasks.values()])
-
-        asyncio.run(run())
+            return await super().run_task(task_class, name, args)
+
+        seconds = self.get_task_timeout(task_class, name)
+
+        async def run_on_host(host):
+            task = getattr(task_class(self, self._lock, host), name)
+            async with self._semaphore, self._get_host_semaphore(host):
+                try:
+                    await asyncio.wait_for(task(*args), seconds)
+                except asyncio.TimeoutError:
+                    raise TaskRunError(f'Timed out after {seconds}s')
+
+        hosts = self._prepare_hosts(task_class, name)
+        for index, batch in enumerate(
+                self._get_batches(task_class, name, hosts)):
+            if index and self.rolling['pause']:
+                await asyncio.sleep(self.rolling['pause'])
+            results = await asyncio.gather(
+                *[run_on_host(host) for host in batch],
+                return_exceptions=True
+            )
+            self._raise_for_errors(task_class, name, batch, results)
+
+    def _get_batches(self, task_class, name, hosts):
+        """Split hosts for rolling tasks into batches by `rolling`
+        settings, other tasks run on all hosts at once."""
+        if not getattr(getattr(task_class, name), '__rolling__', False):
+            return [hosts]
+        size = self.rolling['batch']
+        if self.rolling['percent']:
+            size = math.ceil(len(hosts) * self.rolling['percent'] / 100)
+        size = size or len(hosts) or 1
+        return [hosts[start:start + size] for start in range(
+            0, len(hosts), size)]
+
+    @staticmethod
+    def _raise_for_errors(task_class, name, hosts, results):
+        # one failed host doesn't stop others, errors are reported together
+        errors = [
+            (host, result) for host, result in zip(hosts, results)
+            if isinstance(result, BaseException)
+        ]
+        for _, error in errors:
+            if not isinstance(error, Exception):
+                raise error
+        if len(errors) == 1 and not isinstance(errors[0][1], TaskRunError):
+            raise errors[0][1]
+        if errors:
+            raise TaskRunError(
+                f'Task "{task_class.get_namespace()}.{name}" failed on '
+                f'{len(errors)} of {len(hosts)} hosts:\n' + '\n'.join(
+                    f"[{host.get('name', host['public_ip'])}] {error}"
+                    for host, error in errors
+                )
+            ) from errors[0][1]
 
     def _prepare_hosts(self, task_class, name):
         method = getattr(task_class, name)
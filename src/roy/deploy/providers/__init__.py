@@ -108,3 +108,11 @@ class DeployProvider:
 
     async def initialize(self):
         raise NotImplementedError('Initialize servers from provided services')
+
+
+class StaticProvider(DeployProvider):
+    """Use hosts from settings as is when no provider is needed."""
+    NAME = 'static'
+
+    async def initialize(self):
+        return self.other_hosts
@@ -1,12 +1,11 @@
 import json
 import asyncio
 
-import jinja2
-
 from roy.utils.os import run_in_shell
 
 from . import DeployProvider
 from ..settings import SETTINGS
+from ..templates import get_template
 
 
 class VagrantProvider(DeployProvider):
@@ -28,10 +27,9 @@ class VagrantProvider(DeployProvider):
         'vm': {'type': 'string', 'allowed': ['virtualbox', 'parallels']}
     }
 
-    def generate_vagrant_file(self):
-        template = jinja2.Template(
-            (self.local_root / 'Vagrantfile').read_text())
-        result = template.render(**{'provider': self})
+    async def generate_vagrant_file(self):
+        template = get_template(self.local_root / 'Vagrantfile')
+        result = await template.render_async(provider=self)
         current_file = (self.project_dir / 'Vagrantfile')
         return current_file, result
 
@@ -66,7 +64,7 @@ class VagrantProvider(DeployProvider):
                     vm = new_vm
                 server['vm'] = vm
 
-        vagrant_file, vagrant_contents = self.generate_vagrant_file()
+        vagrant_file, vagrant_contents = await self.generate_vagrant_file()
         if old_hosts_file.exists():
             changed = False
             vm_changed = False
@@ -1,15 +1,13 @@
-import os
 import json
 import copy
 import inspect
+import functools
 import importlib
 
 from pathlib import Path
 
-import jinja2
-
-from roy.utils.os import run_in_shell
-from roy.utils.collections import update_dict_recur
+from roy.utils.os import run_in_shell, get_local_ips
+from roy.utils.collections import LayeredMapping, update_dict_recur
 from roy.app.settings import (
     ComponentSettings, validate_schema, SETTINGS as APP_SETTINGS
 )
@@ -43,6 +41,56 @@ class DeploySettings(ComponentSettings):
         'default_providers': {'type': 'list'},
         'providers': {'type': 'list'},
         'provider': {'type': 'dict', 'required': False},
+        'ssh': {
+            'type': 'dict',
+            'schema': {
+                'transport': {
+                    'type': 'string',
+                    'allowed': ['subprocess', 'asyncssh']
+                },
+                'multiplex': {'type': 'boolean'},
+                'persist': {'type': 'integer'}
+            }
+        },
+        'cache': {
+            'type': 'dict',
+            'schema': {
+                'dir': {'type': 'string'},
+                'builds': {'type': 'boolean'},
+                'downloads': {'type': 'boolean'},
+                'mirror': {'type': 'string'}
+            }
+        },
+        'concurrency': {
+            'type': 'dict',
+            'schema': {
+                'global': {'type': 'integer', 'min': 0},
+                'host': {'type': 'integer', 'min': 0}
+            }
+        },
+        'timeouts': {
+            'type': 'dict',
+            'schema': {
+                'command': {'type': 'number', 'min': 0},
+                'task': {'type': 'number', 'min': 0}
+            }
+        },
+        'rolling': {
+            'type': 'dict',
+            'schema': {
+                'batch': {'type': 'integer', 'min': 0},
+                'percent': {'type': 'integer', 'min': 0, 'max': 100},
+                'pause': {'type': 'number', 'min': 0}
+            }
+        },
+        'retries': {
+            'type': 'dict',
+            'schema': {
+                'attempts': {'type': 'integer', 'min': 1},
+                'delay': {'type': 'number', 'min': 0},
+                'backoff': {'type': 'number', 'min': 1}
+            }
+        },
         'hosts': {
             'type': 'dict',
             'keyschema': {'type': 'string'},
@@ -76,6 +124,17 @@ class DeploySettings(ComponentSettings):
         'providers': [],
         'provider': {},
         'tasks': [],
+        'ssh': {'transport': 'subprocess', 'multiplex': True, 'persist': 60},
+        'concurrency': {'global': 0, 'host': 1},
+        # commands with timeout run without terminal, ssh then needs
+        # agent for keys with passphrase and known host keys
+        'timeouts': {'command': 0, 'task': 0},
+        'retries': {'attempts': 3, 'delay': 1, 'backoff': 2},
+        'rolling': {'batch': 0, 'percent': 0, 'pause': 0},
+        'cache': {
+            'dir': '~/.cache/roy', 'builds': True,
+            'downloads': True, 'mirror': ''
+        },
         'hosts': {},
     }
 
@@ -91,53 +150,164 @@ class DeploySettings(ComponentSettings):
 
     @property
     def hosts(self):
-        return self._data['hosts']
+        """Own hosts copy, providers complete hosts in place."""
+        return LayeredMapping(self._data['hosts']).to_dict()
+
+    @property
+    def ssh(self):
+        return self._data['ssh']
+
+    @property
+    def cache(self):
+        return self._data['cache']
+
+    @property
+    def cache_dir(self):
+        return Path(self._data['cache']['dir']).expanduser()
+
+    @property
+    def concurrency(self):
+        return self._data['concurrency']
+
+    @property
+    def timeouts(self):
+        return self._data['timeouts']
+
+    @property
+    def retries(self):
+        return self._data['retries']
+
+    @property
+    def rolling(self):
+        return self._data['rolling']
 
     @property
     def providers(self):
-        return self._data['provider']
+        return LayeredMapping(self._data['provider']).to_dict()
 
     @property
     def prefix(self):
         return self._data.get('prefix', '')
 
+    @property
+    def tasks_loaders(self):
+        """Default tasks by expected namespace named after module, module
+        is imported only when its tasks are requested."""
+        return {
+            self._get_module_name(module_path): functools.partial(
+                self._find_class, module_path, 'DeployTasks')
+            for module_path in self._data['default_tasks']
+        }
+
     @property
     def tasks_classes(self):
-        tasks = self._data['default_tasks'] + self._data['tasks']
-        return self._find_classes(tasks, 'DeployTasks')
+        return self._find_classes(self._data['tasks'], 'DeployTasks')
 
     @property
     def provider_classes(self):
-        providers = self._data['default_providers'] + self._data['providers']
+        """Default providers are imported only if used by any host or
+        if custom providers are set."""
+        providers = self._data['default_providers']
+        if not self._data['providers']:
+            used = {
+                host.get('provider', {}).get('name', '')
+                for host in self._data['hosts'].values()
+            }
+            providers = [
+                module_path for module_path in providers
+                if self._get_module_name(module_path) in used
+            ]
+        providers = providers + self._data['providers']
         return self._find_classes(providers, 'DeployProvider')
 
+    @staticmethod
+    def _get_module_name(module_path):
+        return module_path.split(':')[0].rsplit('.', 1)[-1]
+
     def _find_classes(self, modules, subclass):
-        classes = []
-        for module_path in modules:
-            class_path = ''
-            if ':' in module_path:
-                module_path, class_path = module_path.split(':')
-            module = importlib.import_module(module_path)
-            if not class_path:
-                for name, value in module.__dict__.items():
-                    if name == subclass:
-                        continue
-
-                    for mro in getattr(value, '__mro__', []):
-                        if mro.__name__ == subclass:
-                            class_path = name
-                            break
-
-            if not class_path:
-                raise ValueError(
-                    f"Can't find subclassed {subclass} in {module}")
-            classes.append(getattr(module, class_path))
-        return classes
+        return [
+            self._find_class(module_path, subclass)
+            for module_path in modules
+        ]
+
+    @staticmethod
+    def _find_class(module_path, subclass):
+        class_path = ''
+        if ':' in module_path:
+            module_path, class_path = module_path.split(':')
+        module = importlib.import_module(module_path)
+        if not class_path:
+            for name, value in module.__dict__.items():
+                if name == subclass:
+                    continue
+
+                for mro in getattr(value, '__mro__', []):
+                    if mro.__name__ == subclass:
+                        class_path = name
+                        break
+
+        if not class_path:
+            raise ValueError(
+                f"Can't find subclassed {subclass} in {module}")
+        return getattr(module, class_path)
 
 
 SETTINGS = DeploySettings()
 
 
+class HostsInventory:
+    """Hosts from settings cache file indexed by name, ips and
+    components, file is parsed again only after it was changed."""
+
+    def __init__(self):
+        self._stamp = None
+        self._positions = {}
+        self._by_name = {}
+        self._by_ip = {}
+        self._by_component = {}
+
+    def _load(self):
+        hosts_file = SETTINGS.settings_cache_file
+        try:
+            stat = hosts_file.stat()
+            stamp = (str(hosts_file), stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return
+
+        hosts = json.loads(hosts_file.read_text()) if stamp else {}
+        self._by_name, self._by_ip, self._by_component = {}, {}, {}
+        self._positions = {}
+        for position, (name, host) in enumerate(hosts.items()):
+            self._positions[id(host)] = position
+            self._by_name[host.get('name', name)] = host
+            for ip in {host.get('public_ip'), host.get('private_ip')}:
+                self._by_ip.setdefault(ip, []).append(host)
+            for component in host.get('components', {}):
+                self._by_component.setdefault(component, []).append(host)
+        self._stamp = stamp
+
+    def get_by_name(self, name: str) -> dict:
+        self._load()
+        return self._by_name.get(name)
+
+    def get_by_ips(self, ips) -> list:
+        self._load()
+        hosts = {}
+        for ip in ips:
+            for host in self._by_ip.get(ip, []):
+                hosts[self._positions[id(host)]] = host
+        return [hosts[position] for position in sorted(hosts)]
+
+    def get_by_component(self, component: str) -> list:
+        self._load()
+        return list(self._by_component.get(component, []))
+
+
+INVENTORY = HostsInventory()
+
+
 class DeployComponentSettings:
     NAME = ''
     DEFAULT = {}
@@ -168,29 +338,20 @@ class DeployComponentSettings:
     @classmethod
     def get_for_host(cls, current=None):
         current = current or {}
-        host_ips = set() if current else set(
-            os.popen('hostname -I').read().split())
-
-        for host in cls.get_for_all_hosts():
-            is_valid_host = (
-                'name' in current and host['name'] == current['name'] or
-                host['public_ip'] in host_ips or host['private_ip'] in host_ips
-            )
-            if is_valid_host:
+        if current:
+            host = INVENTORY.get_by_name(current.get('name'))
+            hosts = [host] if host else []
+        else:
+            hosts = INVENTORY.get_by_ips(get_local_ips())
+
+        for host in hosts:
+            if cls.NAME in host.get('components', {}):
                 return host['components'][cls.NAME], host
         return {}, {}
 
     @classmethod
     def get_for_all_hosts(cls):
-        hosts_file = SETTINGS.settings_cache_file
-        if hosts_file.exists():
-            hosts = json.loads(hosts_file.read_text())
-            return [
-                host
-                for host in hosts.values()
-                if cls.NAME in host.get('components', {})
-            ]
-        return []
+        return INVENTORY.get_by_component(cls.NAME)
 
     def get(self, **attrs):
         return next(self.filter(**attrs), self)
@@ -0,0 +1,317 @@
+import re
+import time
+import shutil
+import asyncio
+import tempfile
+
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+from roy.utils.os import (
+    run_in_shell, stream_in_shell, RunInShellError, RunInShellTimeoutError
+)
+
+
+# messages printed by ssh itself when command was not started on host
+SSH_CONNECTION_ERRORS = re.compile(
+    r'^(ssh: |kex_exchange_identification: |ssh_exchange_identification: |'
+    r'mux_client_|Connection (closed|reset) by \S+ port \d+)',
+    re.MULTILINE
+)
+
+
+class SSHConnectionError(RunInShellError):
+    """Transport failed to reach host, command can be run again."""
+
+
+def _raise_for_connection(err: RunInShellError):
+    if err.code == 255 and SSH_CONNECTION_ERRORS.search(str(err)):
+        raise SSHConnectionError(str(err), err.code) from err
+    raise err
+
+
+class SSHConnectionPool:
+    """Keep one persistent multiplexed ssh session per (user, host, port)
+    using OpenSSH master connections, all commands and rsync transfers
+    reuse opened session instead of new handshake."""
+
+    def __init__(self, multiplex: bool = True, persist: int = 60):
+        self.multiplex = multiplex
+        self.persist = persist
+        self.stats = {'opens': 0, 'reuses': 0, 'bytes': 0}
+
+        self._connections = {}
+        self._control_dir = None
+
+    @property
+    def control_dir(self) -> Path:
+        if self._control_dir is None:
+            self._control_dir = Path(tempfile.mkdtemp(prefix='roy-ssh-'))
+        return self._control_dir
+
+    def options(self, user: str, host: str, port: int) -> str:
+        """Ssh options to route connection through shared master."""
+        if not self.multiplex:
+            return ''
+
+        key = (user, host, port)
+        if key in self._connections:
+            self.stats['reuses'] += 1
+        else:
+            self.stats['opens'] += 1
+            self._connections[key] = self.control_dir / '%C'
+
+        return (
+            '-o ControlMaster=auto '
+            f'-o ControlPath={self._connections[key]} '
+            f'-o ControlPersist={self.persist}'
+        )
+
+    def track(self, *chunks: str):
+        self.stats['bytes'] += sum(len(chunk.encode()) for chunk in chunks)
+
+    async def close(self):
+        """Stop all master connections and remove control sockets."""
+        connections, self._connections = self._connections, {}
+        commands = [
+            f'ssh -o ControlPath={control_path} -O exit -p {port} '
+            f'{user}@{host}'
+            for (user, host, port), control_path in connections.items()
+        ]
+        await asyncio.gather(*[
+            run_in_shell(f'{command} 2> /dev/null') for command in commands
+        ])
+
+        if self._control_dir is not None:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+
+
+class SSHTransport:
+    """Run commands on remote hosts by spawning ssh binary over shared
+    master connections, used as fallback for interactive commands."""
+    NAME = 'subprocess'
+
+    def __init__(self, multiplex: bool = True, persist: int = 60):
+        self.pool = SSHConnectionPool(multiplex, persist)
+
+    @property
+    def stats(self):
+        return self.pool.stats
+
+    def _get_ssh_command(
+            self, user: str, host: str, port: int, command: str,
+            interactive: bool = False) -> str:
+        command = command.replace('"', r'\"').replace('$(', r'\$(')
+        interactive_flag = '-t' if interactive else ''
+        options = self.pool.options(user, host, port)
+        return (
+            f'ssh {interactive_flag} {options} -p {port} '
+            f'{user}@{host} "{command}"'
+        )
+
+    async def run(
+            self, user: str, host: str, port: int, command: str,
+            interactive: bool = False, input: str = None,
+            timeout: float = None) -> str:
+        try:
+            response = await run_in_shell(
+                self._get_ssh_command(user, host, port, command, interactive),
+                interactive, input, timeout
+            ) or ''
+        except RunInShellTimeoutError:
+            raise
+        except RunInShellError as err:
+            _raise_for_connection(err)
+        self.pool.track(command, input or '', response)
+        return response
+
+    async def stream(
+            self, user: str, host: str, port: int, command: str,
+            prefix: str = '', input: str = None, timeout: float = None):
+        """Yield command output lines as they arrive."""
+        self.pool.track(command, input or '')
+        try:
+            async for line in stream_in_shell(
+                    self._get_ssh_command(user, host, port, command),
+                    prefix, input, timeout):
+                self.pool.track(line)
+                yield line
+        except RunInShellTimeoutError:
+            raise
+        except RunInShellError as err:
+            _raise_for_connection(err)
+
+    async def close(self):
+        await self.pool.close()
+
+
+class AsyncSSHTransport(SSHTransport):
+    """Run commands as channels over one in-process asyncssh connection
+    per host without spawning local processes, number of concurrent
+    channels is limited by sshd `MaxSessions`."""
+    NAME = 'asyncssh'
+    MAX_SESSIONS = 10
+    CHANNEL_OPEN_ATTEMPTS = 10
+    CHANNEL_OPEN_DELAY = 0.5
+
+    def __init__(self, multiplex: bool = True, persist: int = 60):
+        if asyncssh is None:
+            raise ValueError(
+                "Install 'asyncssh' package to use asyncssh transport")
+        super().__init__(multiplex, persist)
+        self._connections = {}
+        self._sessions = {}
+
+    async def _connect(self, user: str, host: str, port: int):
+        key = (user, host, port)
+        loop = asyncio.get_running_loop()
+        connect_loop, connection = self._connections.get(key, (None, None))
+        if connect_loop is loop and self._is_connected(connection):
+            self.stats['reuses'] += 1
+        else:
+            self.stats['opens'] += 1
+            connection = asyncio.ensure_future(
+                asyncssh.connect(host, port=port, username=user))
+            self._connections[key] = (loop, connection)
+            self._sessions[key] = asyncio.Semaphore(self.MAX_SESSIONS)
+        try:
+            return await connection
+        except (OSError, asyncssh.Error) as err:
+            raise SSHConnectionError(
+                f'Connection to {user}@{host}:{port} failed: {err}', 255)
+
+    @staticmethod
+    def _is_connected(connection) -> bool:
+        if not connection.done():
+            return True
+        return not connection.cancelled() and not connection.exception()
+
+    @asynccontextmanager
+    async def _session(self, user: str, host: str, port: int):
+        """Connection with reserved channel slot, commands over limit
+        wait for free slot instead of being refused by server."""
+        connection = await self._connect(user, host, port)
+        async with self._sessions[(user, host, port)]:
+            yield connection
+
+    async def _open_channel(self, call):
+        """Open channel again after delay when server still refuses
+        session because of lower `MaxSessions` limit."""
+        for attempt in range(1, self.CHANNEL_OPEN_ATTEMPTS + 1):
+            try:
+                return await call()
+            except asyncssh.ChannelOpenError as err:
+                if attempt == self.CHANNEL_OPEN_ATTEMPTS:
+                    raise SSHConnectionError(f'Channel open failed: {err}')
+                await asyncio.sleep(self.CHANNEL_OPEN_DELAY * attempt)
+
+    def _lost(self, user: str, host: str, port: int, err):
+        # reconnect on next run
+        self._connections.pop((user, host, port), None)
+        return SSHConnectionError(
+            f'Connection to {user}@{host}:{port} lost: {err}', 255)
+
+    async def run(
+            self, user: str, host: str, port: int, command: str,
+            interactive: bool = False, input: str = None,
+            timeout: float = None) -> str:
+        if interactive:
+            return await super().run(
+                user, host, port, command, interactive, timeout=timeout)
+
+        try:
+            async with self._session(user, host, port) as connection:
+                result = await asyncio.wait_for(
+                    self._open_channel(
+                        lambda: connection.run(command, input=input)),
+                    timeout or None
+                )
+        except asyncio.TimeoutError:
+            raise RunInShellTimeoutError(
+                f'Shell command "{command}" timed out after {timeout}s')
+        except (OSError, asyncssh.DisconnectError) as err:
+            raise self._lost(user, host, port, err)
+        except asyncssh.Error as err:
+            raise RunInShellError(f'Shell command "{command}" failed: {err}')
+        self.pool.track(
+            command, input or '', result.stdout, result.stderr)
+        if result.stderr and result.exit_status != 0:
+            raise RunInShellError(
+                f'Shell command "{command}" finished with '
+                f'error code [{result.exit_status}]:\n'
+                f'{result.stderr} ', result.exit_status
+            )
+        return result.stdout
+
+    async def stream(
+            self, user: str, host: str, port: int, command: str,
+            prefix: str = '', input: str = None, timeout: float = None,
+            tail: int = 100):
+        """Yield command output lines as they arrive over channel of
+        shared connection."""
+        self.pool.track(command, input or '')
+        lines = deque(maxlen=tail)
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            async with self._session(user, host, port) as connection:
+                process = await self._open_channel(
+                    lambda: connection.create_process(
+                        command, input=input, stderr=asyncssh.STDOUT))
+                try:
+                    while True:
+                        remaining = None
+                        if deadline is not None:
+                            remaining = max(deadline - time.monotonic(), 0)
+                        line = await asyncio.wait_for(
+                            process.stdout.readline(), remaining)
+                        if not line:
+                            break
+                        line = line.rstrip('\n')
+                        self.pool.track(line)
+                        lines.append(line)
+                        yield f'{prefix}{line}'
+                    await process.wait_closed()
+                finally:
+                    process.close()
+        except asyncio.TimeoutError:
+            raise RunInShellTimeoutError(
+                f'Shell command "{command}" timed out after '
+                f'{timeout}s:\n' + '\n'.join(lines)
+            )
+        except (OSError, asyncssh.DisconnectError) as err:
+            raise self._lost(user, host, port, err)
+        except asyncssh.Error as err:
+            raise RunInShellError(f'Shell command "{command}" failed: {err}')
+
+        if process.returncode:
+            raise RunInShellError(
+                f'Shell command "{command}" finished with '
+                f'error code [{process.returncode}]:\n' + '\n'.join(lines),
+                process.returncode
+            )
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        connections, self._connections = self._connections, {}
+        self._sessions = {}
+        for connect_loop, connection in connections.values():
+            if connect_loop is not loop or not connection.done() or \
+                    not self._is_connected(connection):
+                continue
+            connection = connection.result()
+            connection.close()
+            await connection.wait_closed()
+        await super().close()
+
+
+TRANSPORTS = {
+    transport.NAME: transport
+    for transport in (SSHTransport, AsyncSSHTransport)
+}
@@ -1,15 +1,36 @@
+import io
+import json
+import time
+import uuid
+import base64
+import tarfile
+import contextvars
 import asyncio
+import hashlib
 import logging
+import shutil
 import functools
+import urllib.request
 
 from contextlib import contextmanager, asynccontextmanager
+from collections import deque
 from pathlib import Path
 
-import jinja2
-
+from roy.utils.os import RunInShellError
+from roy.utils.files import calc_sha256_for_file
 from roy.utils.tasks import Tasks, TaskRunError, register
 
-from .settings import DeployComponentSettings
+from .ssh import SSHConnectionError
+from .settings import DeployComponentSettings, SETTINGS as DEPLOY_SETTINGS
+from .templates import RECORDED_TEMPLATES, get_template
+
+
+# seconds without data before download is failed
+DOWNLOAD_TIMEOUT = 60
+# names of host facts used by `incremental` task while it runs
+RECORDED_FACTS = contextvars.ContextVar('recorded_facts', default=None)
+# set while call is retried, nested calls are not retried again
+RETRYING = contextvars.ContextVar('retrying', default=False)
 
 
 def as_root(func):
@@ -23,6 +44,99 @@ def as_root(func):
     return wrapper
 
 
+def incremental(inventory: bool = False):
+    """Skip task when fingerprint of its inputs (settings, component
+    files, host, optionally hosts inventory and templates and host
+    facts used by previous run) matches one stored on host after
+    previous run, `-f` flag forces run."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            name = f'{self.settings.NAME}.{func.__qualname__}'
+            path = Path('/', 'var', 'lib', 'roy', 'fingerprints', name)
+
+            if not self._manager.override:
+                with self._set_user('root'):
+                    stored = await self._run(
+                        f'cat {path} 2> /dev/null || true')
+                stored, _, used = stored.partition('\n')
+                try:
+                    used = json.loads(used or '{}')
+                except ValueError:
+                    used = {}
+                fingerprint = await self._get_fingerprint(
+                    name, inventory, used, *args, **kwargs)
+                if stored == fingerprint:
+                    if self._manager.debug:
+                        print(f'[{self.host_name}] {name} not changed')
+                    return None
+
+            templates, facts = set(), set()
+            templates_token = RECORDED_TEMPLATES.set(templates)
+            facts_token = RECORDED_FACTS.set(facts)
+            try:
+                result = await func(self, *args, **kwargs)
+            finally:
+                RECORDED_TEMPLATES.reset(templates_token)
+                RECORDED_FACTS.reset(facts_token)
+            # inputs of nested tasks are inputs of outer one too
+            for recorded, values in (
+                    (RECORDED_TEMPLATES, templates), (RECORDED_FACTS, facts)):
+                if recorded.get() is not None:
+                    recorded.get().update(values)
+
+            used = {'templates': sorted(templates), 'facts': sorted(facts)}
+            fingerprint = await self._get_fingerprint(
+                name, inventory, used, *args, **kwargs)
+            with self._set_user('root'):
+                await self._run(
+                    f'mkdir -p {path.parent} && cat > {path}',
+                    input=f'{fingerprint}\n{json.dumps(used)}'
+                )
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def fact(func):
+    """Host fact requested once per run, facts used by `incremental`
+    task are part of its fingerprint."""
+
+    @functools.wraps(func)
+    async def wrapper(self):
+        recorded = RECORDED_FACTS.get()
+        if recorded is not None:
+            recorded.add(func.__name__)
+        key = (self.public_ip, func.__name__)
+        facts = self._manager.facts
+        async with self._manager.get_lock(key):
+            if key not in facts:
+                facts[key] = await func(self)
+        return facts[key]
+
+    return wrapper
+
+
+def retry(func):
+    """Run idempotent task again on failure with exponential backoff
+    configured by deploy `retries` settings."""
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self._retry(lambda: func(self, *args, **kwargs))
+
+    return wrapper
+
+
+def is_connection_error(err: TaskRunError) -> bool:
+    """Transport failed to reach host, exit code of command itself is
+    never treated as connection error."""
+    return isinstance(err.__cause__, SSHConnectionError)
+
+
 def nohost(task):
     task.__nohost__ = True
     return task
@@ -38,6 +152,28 @@ def firsthost(task):
     return task
 
 
+def rolling(task):
+    """Run task on hosts in batches by deploy `rolling` settings, next
+    batch starts only after previous one succeeded."""
+    task.__rolling__ = True
+    return task
+
+
+class BatchCommand:
+    """Command recorded inside `DeployTasks._batch`, output and exit
+    code are filled after batch is executed."""
+
+    def __init__(self, user: str, command: str, strip: bool = True):
+        self.user = user
+        self.command = command
+        self.strip = strip
+        self.output = ''
+        self.code = None
+
+    def __str__(self):
+        return self.output
+
+
 class DeployTasks(Tasks):
     SETTINGS = None
 
@@ -58,6 +194,7 @@ class DeployTasks(Tasks):
         self.user = self.settings.user
 
         self._current_prefix = ''
+        self._batch_commands = None
         self._logger = logging.getLogger(self.__class__.__name__)
         self._lock = lock
 
@@ -74,9 +211,48 @@ class DeployTasks(Tasks):
                 if issubclass(task_class, DeployTasks):
                     yield task_class(self._manager, self._lock, host)
 
+    async def _get_fingerprint(
+            self, name, inventory=False, used=None, *args, **kwargs):
+        """Hash of task inputs, `used` templates paths and facts names
+        are recorded by previous run."""
+        used = used or {}
+        files = sorted(
+            path for path in self.settings.local_root.iterdir()
+            if path.is_file() and path.suffix not in {'.pyc', '.render'}
+        )
+        templates = {}
+        for template in used.get('templates', []):
+            try:
+                templates[template] = calc_sha256_for_file(Path(template))
+            except OSError:
+                templates[template] = None
+        inputs = {
+            'name': name,
+            'args': [args, kwargs],
+            'settings': self.settings._data,
+            'host': [self.public_ip, self.private_ip, self.ssh_port],
+            'files': {
+                path.name: calc_sha256_for_file(path) for path in files
+            },
+            'templates': templates,
+            'facts': {
+                fact_name: await getattr(self, fact_name)()
+                for fact_name in used.get('facts', [])
+                if hasattr(self, fact_name)
+            },
+            'hosts': self._manager.hosts if inventory else {}
+        }
+        inputs = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    @fact
+    async def _get_cpu_cores(self) -> int:
+        """Number of host cpu cores, requested once per run."""
+        return int(await self._run('nproc --all'))
+
     async def _calc_instances_count(self, count: int = 0, percent: int = 0):
         if percent:
-            cpu_cores = int(await self._run('nproc --all'))
+            cpu_cores = await self._get_cpu_cores()
             cpu_cores = int(cpu_cores / 100.0 * percent)
             cpu_cores += count
             count = cpu_cores
@@ -123,6 +299,67 @@ class DeployTasks(Tasks):
             if temporary:
                 await self._rmrf(path)
 
+    @asynccontextmanager
+    async def _batch(self):
+        """Record `_run` calls and execute them as one remote script on
+        exit, calls return `BatchCommand` instead of output."""
+        if self._batch_commands is not None:
+            yield
+            return
+
+        self._batch_commands = []
+        try:
+            yield
+        finally:
+            commands, self._batch_commands = self._batch_commands, None
+
+        groups = []
+        for command in commands:
+            if not groups or groups[-1][0].user != command.user:
+                groups.append([])
+            groups[-1].append(command)
+
+        for group in groups:
+            with self._set_user(group[0].user):
+                await self._run_batch(group)
+
+    async def _run_batch(self, commands):
+        token = uuid.uuid4().hex
+        script = []
+        for command in commands:
+            # script itself is read from stdin, commands must not read it
+            script.append(
+                f'( {command.command}\n) < /dev/null 2>&1\n'
+                'code=$?\n'
+                f'printf "\\n{token}:%s\\n" "$code"\n'
+                '[ "$code" -eq 0 ] || exit "$code"\n'
+            )
+        old_prefix, self._current_prefix = self._current_prefix, ''
+        try:
+            output = await self._run(
+                'bash -s', strip=False, input=''.join(script))
+        finally:
+            self._current_prefix = old_prefix
+
+        chunks = output.split(f'\n{token}:')
+        if len(chunks) == 1:
+            raise TaskRunError(f'Batch script failed:\n{output}')
+        for index, command in enumerate(commands[:len(chunks) - 1]):
+            command.output = chunks[index]
+            if index:
+                code, command.output = command.output.split('\n', 1)
+                commands[index - 1].code = int(code)
+            if command.strip:
+                command.output = command.output.strip()
+        commands[len(chunks) - 2].code = int(chunks[-1].strip())
+
+        for command in commands:
+            if command.code:
+                raise TaskRunError(
+                    f'Command "{command.command}" finished with error '
+                    f'code [{command.code}]:\n{command.output}'
+                )
+
     @as_root
     async def _sudo(self, command, strip=True):
         """Run command on server as root user."""
@@ -147,50 +384,115 @@ class DeployTasks(Tasks):
             '/', 'home' if user != 'root' else '', user, '.ssh')
 
         with self._set_user('root'):
-            try:
-                await self._run("id -u {}".format(user))
-            except TaskRunError:
+            async with self._batch():
                 await self._run(
+                    "id -u {0} > /dev/null || "
                     "adduser --quiet --disabled-password"
                     " --gecos \"{0}\" {0}".format(user)
                 )
-            try:
-                await self._run(f"cat {keys_path / 'authorized_keys'}")
-            except TaskRunError:
-                await self._mkdir(keys_path)
-                await self._run(f'chown -hR {user} {keys_path}')
-                await self._run('echo "{}" >> {}'.format(
-                    local_ssh_public_key.read_text().strip(),
-                    keys_path / 'authorized_keys'
-                ))
+                await self._run(
+                    f"test -f {keys_path / 'authorized_keys'} || ("
+                    f"mkdir -p {keys_path} && "
+                    f"chown -hR {user} {keys_path} && "
+                    'echo "{}" >> {})'.format(
+                        local_ssh_public_key.read_text().strip(),
+                        keys_path / 'authorized_keys'
+                    )
+                )
 
+    @retry
     @as_root
     async def _apt_install(self, *packages):
-        with self._prefix('DEBIAN_FRONTEND=noninteractive'):
-            await self._run('apt-get update -y -q')
-            await self._run(
-                'apt-get install -y -q --no-install-recommends '
-                '--no-install-suggests {}'.format(' '.join(packages))
-            )
+        async with self._batch():
+            with self._prefix('DEBIAN_FRONTEND=noninteractive'):
+                await self._run('apt-get update -y -q')
+                await self._run(
+                    'apt-get install -y -q --no-install-recommends '
+                    '--no-install-suggests {}'.format(' '.join(packages))
+                )
 
-    async def _run(self, command, strip=True, interactive=False) -> str:
-        command = str(command).replace('"', r'\"').replace('$(', r'\$(')
-        interactive_flag = '-t' if interactive else ''
+    async def _retry(self, call, retryable=None):
+        """Await `call` until it succeeds or attempts are exhausted,
+        `retryable` limits which errors are retried. Inside of retried
+        call there is only one attempt, outer call retries it."""
+        if RETRYING.get():
+            return await call()
+
+        retries = self._manager.retries
+        delay = retries['delay']
+        for attempt in range(1, retries['attempts'] + 1):
+            token = RETRYING.set(True)
+            try:
+                return await call()
+            except TaskRunError as err:
+                error = err
+            finally:
+                RETRYING.reset(token)
+
+            if attempt == retries['attempts'] or \
+                    (retryable and not retryable(error)):
+                raise error
+            if self._manager.debug:
+                print(
+                    f'[{self.host_name}] attempt {attempt} failed, '
+                    f'retry in {delay}s: {error}'
+                )
+            await asyncio.sleep(delay)
+            delay *= retries['backoff']
+
+    async def _run(
+            self, command, strip=True, interactive=False, input=None,
+            stream=False, timeout=None, retry=False) -> str:
+        """Run command on host, with `stream` output lines are printed
+        as they arrive in debug mode and only last lines are returned.
+        Command is killed after `timeout` seconds, connection failures
+        are retried and with `retry` any failure is retried."""
+        command = str(command)
+        is_batch = not interactive and input is None and not stream
+        if self._batch_commands is not None and is_batch:
+            command = BatchCommand(
+                self.user, f'{self._current_prefix}{command}', strip)
+            self._batch_commands.append(command)
+            return command
         if self._manager.debug:
             print(
                 f"[{self.host_name}:"
                 f"{self.user}@{self.public_ip}] {command}"
             )
-        response = await self._local(
-            f"ssh {interactive_flag} -p {self.ssh_port} "
-            f"{self.user}@{self.public_ip} "
-            f'"{self._current_prefix}{command}"',
-            interactive=interactive, debug=False
-        ) or ''
+
+        command = f'{self._current_prefix}{command}'
+        if timeout is None:
+            timeout = self._manager.command_timeout
+
+        async def call():
+            try:
+                if stream:
+                    return await self._stream(command, input, timeout)
+                return await self._manager.transport.run(
+                    self.user, self.public_ip, self.ssh_port, command,
+                    interactive, input, timeout
+                )
+            except RunInShellError as err:
+                raise TaskRunError(err) from err
+
+        response = await self._retry(
+            call, None if retry else is_connection_error)
         if strip:
             response = response.strip()
         return response
 
+    async def _stream(
+            self, command, input=None, timeout=None, tail=100) -> str:
+        prefix = f'[{self.host_name}] '
+        lines = deque(maxlen=tail)
+        async for line in self._manager.transport.stream(
+                self.user, self.public_ip, self.ssh_port, command,
+                prefix, input, timeout):
+            if self._manager.debug:
+                print(line)
+            lines.append(line[len(prefix):])
+        return '\n'.join(lines)
+
     async def _rmrf(self, path: Path):
         await self._run(f'rm -rf {path}')
 
@@ -216,9 +518,11 @@ class DeployTasks(Tasks):
         paths = ' '.join(paths)
         include = ' '.join(f"--include '{i}'" for i in include or [])
         if local_path.exists() or from_host:
+            ssh_options = self._manager.transport.pool.options(
+                self.user, self.public_ip, self.ssh_port)
             await self._local(
-                f'rsync -rave "ssh -p {self.ssh_port}" --delete {include} '
-                f'{exclude} {paths}'
+                f'rsync -rave "ssh {ssh_options} -p {self.ssh_port}" '
+                f'--delete {include} {exclude} {paths}'
             )
 
     async def _upload_template(
@@ -227,21 +531,163 @@ class DeployTasks(Tasks):
         context.setdefault('deploy', self)
         context.setdefault('settings', self.settings)
 
-        async with self._lock:
-            render_path = Path(f'{local_path}.render')
-            template = jinja2.Template(
-                local_path.read_text(), enable_async=True)
-            render_path.write_text(await template.render_async(context))
+        template = get_template(local_path)
+        await self._upload_content(await template.render_async(context), path)
+
+    async def _upload_content(self, content: str, path: Path):
+        """Write content to file on host, skipped if remote file has
+        same sha256 sum."""
+        checksum = hashlib.sha256(content.encode()).hexdigest()
+        key = (self.public_ip, self.user, str(path))
+        uploads = self._manager.uploads
+        if uploads.get(key) != checksum:
+            remote_checksum = await self._run(
+                f'sha256sum {path} 2> /dev/null || true')
+            if remote_checksum.split(' ')[0] != checksum:
+                await self._run(f'cat > {path}', input=content)
+            uploads[key] = checksum
+
+    async def _get_changed_files(self, files: dict) -> dict:
+        """Filter {path: content} to files which differ on host, all
+        remote checksums are read by one command."""
+        uploads = self._manager.uploads
+        checksums = {
+            path: hashlib.sha256(content.encode()).hexdigest()
+            for path, content in files.items()
+        }
+        unknown = [
+            path for path, checksum in checksums.items()
+            if uploads.get((self.public_ip, self.user, str(path))) != checksum
+        ]
+        if not unknown:
+            return {}
+
+        output = await self._run(
+            f"sha256sum {' '.join(map(str, unknown))} 2> /dev/null || true")
+        remote_checksums = dict(
+            reversed(line.split('  ', 1))
+            for line in output.splitlines() if '  ' in line
+        )
+
+        changed = {}
+        for path in unknown:
+            if remote_checksums.get(str(path)) == checksums[path]:
+                uploads[(self.public_ip, self.user, str(path))] = \
+                    checksums[path]
+            else:
+                changed[path] = files[path]
+        return changed
+
+    async def _upload_archive(self, files: dict):
+        """Write {absolute path: content} files on host by one command
+        with gzipped tar archive, can be used inside `_batch`. Archive
+        is passed by stdin of batch script, not by command arguments."""
+        if not files:
+            return
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for path, content in files.items():
+                data = content.encode()
+                info = tarfile.TarInfo(str(path).lstrip('/'))
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+        archive = base64.encodebytes(archive.getvalue()).decode()
+        delimiter = f'ARCHIVE_{uuid.uuid4().hex}'
+
+        async with self._batch():
+            await self._run(
+                f"base64 -d << '{delimiter}' | "
+                "tar xzf - -C / --no-same-owner\n"
+                f"{archive}{delimiter}"
+            )
+        for path, content in files.items():
+            key = (self.public_ip, self.user, str(path))
+            self._manager.uploads[key] = hashlib.sha256(
+                content.encode()).hexdigest()
+
+    async def _fetch(self, url: str) -> Path:
+        """Download url once into local cache, checksum from url fragment
+        like '#sha256=...' or from first download is verified."""
+        url, _, fragment = url.partition('#')
+        checksum = ''
+        if fragment.startswith('sha256='):
+            checksum = fragment[len('sha256='):]
+        digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+        path = DEPLOY_SETTINGS.cache_dir / 'downloads' / digest / \
+            url.split('/')[-1]
+        checksum_path = path.parent / f'{path.name}.sha256'
+        loop = asyncio.get_running_loop()
+
+        async with self._manager.get_lock(path):
+            if not path.exists():
+                if self._manager.debug:
+                    print(f'[local] download {url}')
+                path.parent.mkdir(parents=True, exist_ok=True)
+                downloaded = path.parent / f'{path.name}.part'
+
+                def urlretrieve():
+                    with urllib.request.urlopen(
+                            url, timeout=DOWNLOAD_TIMEOUT) as response, \
+                            downloaded.open('wb') as f:
+                        shutil.copyfileobj(response, f)
+
+                async def retrieve():
+                    try:
+                        await loop.run_in_executor(None, urlretrieve)
+                    except OSError as err:
+                        raise TaskRunError(f'Download {url} failed: {err}')
+
+                await self._retry(retrieve)
+                downloaded.rename(path)
+                checksum_path.unlink(missing_ok=True)
+
+            if checksum_path.exists():
+                checksum = checksum or checksum_path.read_text().strip()
+            actual = await loop.run_in_executor(
+                None, calc_sha256_for_file, path)
+            if checksum and checksum != actual:
+                path.unlink()
+                raise TaskRunError(
+                    f'Checksum mismatch for {url}: {actual} != {checksum}')
+            checksum_path.write_text(actual)
+        return path
+
+    async def _download(self, url: str, archive: str):
+        """Download url to archive in current dir on host, using local
+        cache or mirror host instead of fetching from internet."""
+        cache = DEPLOY_SETTINGS.cache
+        if not cache['downloads']:
+            await self._run(
+                f"wget -nv -T {DOWNLOAD_TIMEOUT} -O {archive} "
+                f"{url.split('#')[0]}", retry=True
+            )
+            return
+
+        if cache['mirror']:
+            digest = hashlib.sha256(url.split('#')[0].encode()).hexdigest()
+            mirror_url = f"{cache['mirror'].rstrip('/')}/{digest[:16]}"
             try:
-                await self._upload(render_path, path)
-            finally:
-                render_path.unlink()
+                await self._run(
+                    f'wget -nv -T {DOWNLOAD_TIMEOUT} -O {archive} '
+                    f'{mirror_url}/{archive}'
+                )
+                return
+            except TaskRunError:
+                await self._rmrf(archive)
+
+        path = await self._fetch(url)
+        remote_path = Path('/tmp', f'{path.parent.name}-{archive}')
+        await self._upload(path, remote_path)
+        await self._run(f'mv {remote_path} {archive}')
 
     async def _download_and_unpack(
             self, url: str, dest_dir: Path = Path('.'),
             archive_dir_name: str = ''):
-        await self._run(f'wget -q {url}')
-        archive = url.split('/')[-1]
+        archive = url.split('#')[0].split('/')[-1]
+        await self._download(url, archive)
         await self._run(f'tar xf {archive}')
         archive_dir = archive_dir_name or archive.split('.tar')[0]
 
@@ -252,11 +698,64 @@ class DeployTasks(Tasks):
                 raise ValueError(f'No archive dir found {new_archive_dir}')
             archive_dir = new_archive_dir.rstrip('/')
 
-        await self._mkdir(dest_dir)
-        await self._run(f'mv {archive_dir}/* {dest_dir}')
-
-        await self._rmrf(archive)
-        await self._rmrf(archive_dir)
+        async with self._batch():
+            await self._mkdir(dest_dir)
+            await self._run(f'mv {archive_dir}/* {dest_dir}')
+
+            await self._rmrf(archive)
+            await self._rmrf(archive_dir)
+
+    async def _get_os_image(self) -> str:
+        info = await self._run('cat /etc/os-release && uname -m')
+        *lines, arch = info.split('\n')
+        release = dict(
+            line.split('=', 1) for line in lines if '=' in line)
+        return '-'.join(
+            release.get(key, '').strip('"') for key in ('ID', 'VERSION_ID')
+        ) + f'-{arch}'
+
+    async def _cached_build(
+            self, name: str, path: Path, build, exclude=None, **key):
+        """Run build once per unique key and os image, compressed
+        contents of path are stored locally and unpacked on other hosts."""
+        if not DEPLOY_SETTINGS.cache['builds']:
+            return await build()
+
+        key = {
+            'name': name, 'path': str(path),
+            'image': await self._get_os_image(), **key
+        }
+        key = json.dumps(key, sort_keys=True, default=str)
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        artifact = DEPLOY_SETTINGS.cache_dir / 'builds' / \
+            f'{name}-{digest}.tar.gz'
+        remote_artifact = Path('/tmp', artifact.name)
+
+        async with self._manager.get_lock(artifact):
+            use_artifact = artifact.exists() and (
+                not self._manager.override or
+                artifact in self._manager.artifacts
+            )
+            if use_artifact:
+                await self._upload(artifact, remote_artifact)
+                async with self._batch():
+                    await self._mkdir(path)
+                    await self._run(f'tar xzf {remote_artifact} -C {path}')
+                    await self._rmrf(remote_artifact)
+                return
+
+            await build()
+
+            exclude = ' '.join(
+                f"--exclude='./{item}'" for item in exclude or [])
+            await self._run(
+                f'tar czf {remote_artifact} {exclude} -C {path} .')
+            artifact.parent.mkdir(parents=True, exist_ok=True)
+            downloaded = artifact.parent / f'{artifact.name}.part'
+            await self._upload(downloaded, remote_artifact, from_host=True)
+            downloaded.rename(artifact)
+            await self._rmrf(remote_artifact)
+            self._manager.artifacts.add(artifact)
 
     async def _append(self, content, dest_file: Path):
         await self._run(
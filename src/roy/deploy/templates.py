@@ -0,0 +1,96 @@
+import functools
+import contextvars
+
+from pathlib import Path
+
+import jinja2
+
+from .settings import SETTINGS
+
+
+COMPONENTS_DIR = Path(__file__).parent / 'components'
+# paths of templates used by `incremental` task while it runs
+RECORDED_TEMPLATES = contextvars.ContextVar(
+    'recorded_templates', default=None)
+
+
+class TemplateLoader(jinja2.FileSystemLoader):
+    """Load templates relative to components dir or by absolute path,
+    compiled templates are reused until file mtime is changed."""
+
+    def get_source(self, environment, template):
+        path = Path(template)
+        if not path.is_absolute():
+            return super().get_source(environment, template)
+
+        try:
+            mtime = path.stat().st_mtime
+            source = path.read_text()
+        except OSError:
+            raise jinja2.TemplateNotFound(template)
+
+        def uptodate():
+            try:
+                return path.stat().st_mtime == mtime
+            except OSError:
+                return False
+
+        return source, str(path), uptodate
+
+
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Cache dir is created on first write, templates are compiled
+    without cache if it can not be used."""
+
+    def load_bytecode(self, bucket):
+        try:
+            super().load_bytecode(bucket)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket):
+        try:
+            Path(self.directory).mkdir(parents=True, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment() -> jinja2.Environment:
+    """Shared environment for all deploy templates with on disk
+    bytecode cache."""
+    cache_dir = SETTINGS.cache_dir / 'jinja2'
+    return jinja2.Environment(
+        loader=TemplateLoader(str(COMPONENTS_DIR)),
+        bytecode_cache=BytecodeCache(str(cache_dir)),
+        enable_async=True,
+        auto_reload=True,
+        cache_size=1000
+    )
+
+
+def _record(path: Path):
+    recorded = RECORDED_TEMPLATES.get()
+    if recorded is not None:
+        path = Path(path)
+        if not path.is_absolute():
+            path = COMPONENTS_DIR / path
+        recorded.add(str(path.resolve()))
+
+
+def get_template(path: Path) -> jinja2.Template:
+    _record(path)
+    return get_environment().get_template(str(path))
+
+
+def read_template(path: Path) -> str:
+    """Template source to render from string, path is recorded as
+    template input."""
+    _record(path)
+    return Path(path).read_text()
+
+
+@functools.lru_cache(maxsize=128)
+def get_template_from_string(source: str) -> jinja2.Template:
+    return get_environment().from_string(source)
@@ -0,0 +1,41 @@
+import os
+import asyncio
+
+from roy.utils.os import run_in_shell
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.components.redis import RedisTasks
+
+
+class LocalTransport:
+    """Run commands in local shell instead of remote host."""
+
+    def __init__(self):
+        self.commands = []
+
+    async def run(
+            self, user, host, port, command, interactive=False, input=None,
+            timeout=None):
+        self.commands.append(command)
+        return await run_in_shell(command, input=input) or ''
+
+
+def test_upload_archive_over_argument_limit(tmp_path):
+    manager = DeployTasksManager()
+    manager.transport = LocalTransport()
+    tasks = RedisTasks(manager, asyncio.Lock(), {})
+    # random content is not compressed below 128KiB argument limit
+    files = {
+        tmp_path / f'unit_{index}.service': os.urandom(50000).hex()
+        for index in range(5)
+    }
+
+    async def upload():
+        async with tasks._batch():
+            output = await tasks._run('echo started')
+            await tasks._upload_archive(files)
+        return str(output)
+
+    assert asyncio.run(upload()) == 'started'
+    assert manager.transport.commands == ['bash -s']
+    for path, content in files.items():
+        assert path.read_text() == content
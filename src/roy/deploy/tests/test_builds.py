@@ -0,0 +1,86 @@
+import shutil
+import asyncio
+
+from roy.utils.os import run_in_shell
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.settings import SETTINGS as DEPLOY_SETTINGS
+from roy.deploy.components.redis import RedisTasks
+
+
+class LocalTransport:
+    """Run commands in local shell instead of remote host."""
+
+    async def run(
+            self, user, host, port, command, interactive=False, input=None,
+            timeout=None):
+        return await run_in_shell(command, input=input) or ''
+
+
+class BuildTasks(RedisTasks):
+    builds = 0
+
+    async def _upload(
+            self, local_path, path=None, exclude=None, include=None,
+            from_host=False):
+        if from_host:
+            local_path, path = path, local_path
+        shutil.copy(local_path, path)
+
+    async def build(self, path, version):
+        async def build():
+            BuildTasks.builds += 1
+            await self._run(
+                f'mkdir -p {path}/bin {path}/logs && '
+                f'echo {version} > {path}/bin/app && '
+                f'echo started > {path}/logs/app.log'
+            )
+
+        await self._cached_build(
+            'app', path, build, exclude=['logs'], version='1.0')
+
+
+def run_build(path, hosts, version, override=False):
+    """Build on hosts one by one, every host starts with empty `path`
+    and its result is collected before next one."""
+    manager = DeployTasksManager()
+    manager.transport = LocalTransport()
+    manager.override = override
+    results = {}
+
+    async def build():
+        for host in hosts:
+            shutil.rmtree(path, ignore_errors=True)
+            tasks = BuildTasks(manager, asyncio.Lock(), {})
+            tasks.public_ip = host
+            await tasks.build(path, version)
+            results[host] = (
+                (path / 'bin' / 'app').read_text(),
+                (path / 'logs').exists()
+            )
+
+    asyncio.run(build())
+    return results
+
+
+def test_cached_build_artifact(tmp_path, cache_dir, monkeypatch):
+    monkeypatch.setitem(DEPLOY_SETTINGS._data, 'cache', dict(
+        DEPLOY_SETTINGS.cache, builds=True))
+    monkeypatch.setattr(BuildTasks, 'builds', 0)
+    artifacts = cache_dir / 'builds'
+    path = tmp_path / 'app'
+
+    # second host unpacks artifact of first one without excluded logs
+    assert run_build(path, ['web-1', 'web-2'], 'v1') == {
+        'web-1': ('v1\n', True), 'web-2': ('v1\n', False)}
+    assert BuildTasks.builds == 1
+    assert len(list(artifacts.glob('*.tar.gz'))) == 1
+
+    # next run reuses stored artifact
+    assert run_build(path, ['web-3'], 'v2') == {'web-3': ('v1\n', False)}
+    assert BuildTasks.builds == 1
+
+    # `-f` rebuilds once and other hosts get new artifact
+    assert run_build(path, ['web-1', 'web-2'], 'v2', override=True) == {
+        'web-1': ('v2\n', True), 'web-2': ('v2\n', False)}
+    assert BuildTasks.builds == 2
+    assert len(list(artifacts.glob('*.tar.gz'))) == 1
@@ -0,0 +1,103 @@
+import shutil
+import asyncio
+import hashlib
+import urllib.request
+
+import pytest
+
+from roy.utils.os import run_in_shell
+from roy.utils.tasks import TaskRunError
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.settings import SETTINGS as DEPLOY_SETTINGS
+from roy.deploy.components.redis import RedisTasks
+
+
+class LocalTransport:
+    """Run commands in local shell instead of remote host."""
+
+    def __init__(self):
+        self.commands = []
+
+    async def run(
+            self, user, host, port, command, interactive=False, input=None,
+            timeout=None):
+        self.commands.append(command)
+        return await run_in_shell(command, input=input) or ''
+
+
+class DownloadTasks(RedisTasks):
+    async def _upload(
+            self, local_path, path=None, exclude=None, include=None,
+            from_host=False):
+        shutil.copy(local_path, path)
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """Local archive url, opened urls are counted."""
+    monkeypatch.setitem(DEPLOY_SETTINGS._data, 'cache', dict(
+        DEPLOY_SETTINGS.cache, downloads=True, mirror=''))
+    archive = tmp_path / 'source' / 'package.tar.gz'
+    archive.parent.mkdir()
+    archive.write_bytes(b'package')
+    opened = []
+    urlopen = urllib.request.urlopen
+
+    def count_urlopen(url, *args, **kwargs):
+        opened.append(url)
+        return urlopen(url, *args, **kwargs)
+
+    monkeypatch.setattr(urllib.request, 'urlopen', count_urlopen)
+    return archive.as_uri(), opened
+
+
+def get_tasks(manager=None):
+    manager = manager or DeployTasksManager()
+    manager.transport = LocalTransport()
+    return DownloadTasks(manager, asyncio.Lock(), {})
+
+
+def test_fetch_checksum_mismatch(source):
+    url, opened = source
+    tasks = get_tasks()
+
+    with pytest.raises(TaskRunError, match='Checksum mismatch'):
+        asyncio.run(tasks._fetch(f'{url}#sha256={"0" * 64}'))
+    assert not list((DEPLOY_SETTINGS.cache_dir / 'downloads').glob('*/*.gz'))
+
+    checksum = hashlib.sha256(b'package').hexdigest()
+    path = asyncio.run(tasks._fetch(f'{url}#sha256={checksum}'))
+    assert path.read_bytes() == b'package'
+    assert len(opened) == 2
+
+
+def test_fetch_once_for_all_hosts(source):
+    url, opened = source
+    manager = DeployTasksManager()
+
+    async def fetch():
+        return await asyncio.gather(*[
+            get_tasks(manager)._fetch(url) for _ in range(3)])
+
+    paths = asyncio.run(fetch())
+    assert len(set(paths)) == 1
+    assert opened == [url]
+
+
+def test_download_mirror_fallback(source, tmp_path, monkeypatch):
+    url, opened = source
+    monkeypatch.setitem(DEPLOY_SETTINGS._data, 'cache', dict(
+        DEPLOY_SETTINGS.cache, mirror='http://127.0.0.1:9'))
+    tasks = get_tasks()
+    host_dir = tmp_path / 'host'
+    host_dir.mkdir()
+
+    async def download():
+        async with tasks._cd(host_dir):
+            await tasks._download(url, 'package.tar.gz')
+
+    asyncio.run(download())
+    commands = tasks._manager.transport.commands
+    assert 'http://127.0.0.1:9/' in commands[0]
+    assert (host_dir / 'package.tar.gz').read_bytes() == b'package'
+    assert opened == [url]
@@ -0,0 +1,33 @@
+import sys
+import subprocess
+
+
+SCRIPT = """
+import sys
+from roy.deploy.manager import DEPLOY_TASKS_MANAGER
+DEPLOY_TASKS_MANAGER.tasks['redis']
+print(' '.join(sys.modules))
+"""
+
+
+def test_lazy_components_import(tmp_path):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT],
+        cwd=tmp_path, capture_output=True, text=True, check=True
+    )
+    modules = result.stdout.split()
+    assert 'roy.deploy.components.redis' in modules
+    for module in (
+            'roy.deploy.components.nginx', 'roy.deploy.components.postgres',
+            'roy.deploy.providers.vultr', 'watchgod'):
+        assert module not in modules
+
+    # cumulative import time of manager in microseconds, only reported
+    # because wall clock budget depends on machine
+    timings = {
+        line.split('|')[-1].strip(): int(line.split('|')[1])
+        for line in result.stderr.splitlines()
+        if line.startswith('import time:') and '|' in line and
+        line.split('|')[1].strip().isdigit()
+    }
+    print(f"roy.deploy.manager import: {timings['roy.deploy.manager']}us")
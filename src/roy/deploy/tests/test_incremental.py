@@ -0,0 +1,64 @@
+import asyncio
+
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.settings import DeployComponentSettings
+from roy.deploy.tasks import DeployTasks, incremental
+from roy.deploy.templates import get_template
+
+
+class FilesTransport:
+    """Keep written files in memory instead of remote host."""
+
+    def __init__(self):
+        self.files = {}
+        self.cores = 2
+
+    async def run(
+            self, user, host, port, command, interactive=False, input=None,
+            timeout=None):
+        if command.startswith('cat ') and '||' in command:
+            return self.files.get(command.split()[1], '')
+        if ' && cat > ' in command:
+            self.files[command.split(' && cat > ')[1]] = input
+        if command == 'nproc --all':
+            return str(self.cores)
+        return ''
+
+
+class TemplateSettings(DeployComponentSettings):
+    NAME = 'template'
+
+
+class TemplateTasks(DeployTasks):
+    SETTINGS = TemplateSettings
+    runs = 0
+
+    @incremental()
+    async def sync(self, template):
+        TemplateTasks.runs += 1
+        await self._get_cpu_cores()
+        await get_template(template).render_async()
+
+
+def test_incremental_tracks_templates_and_facts(tmp_path):
+    template = tmp_path / 'external.conf'
+    template.write_text('listen 80;')
+    manager = DeployTasksManager()
+    manager.transport = FilesTransport()
+
+    async def sync():
+        manager.facts = {}
+        manager._locks = {}
+        tasks = TemplateTasks(manager, asyncio.Lock(), {})
+        await tasks.sync(str(template))
+        return TemplateTasks.runs
+
+    assert asyncio.run(sync()) == 1
+    assert asyncio.run(sync()) == 1
+
+    template.write_text('listen 8080;')
+    assert asyncio.run(sync()) == 2
+    assert asyncio.run(sync()) == 2
+
+    manager.transport.cores = 4
+    assert asyncio.run(sync()) == 3
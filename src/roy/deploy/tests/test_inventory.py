@@ -0,0 +1,36 @@
+import json
+
+from roy.deploy.settings import DeploySettings, HostsInventory
+
+
+HOSTS = {
+    'web': {
+        'name': 'web', 'public_ip': '1.1.1.1', 'private_ip': '10.0.0.1',
+        'components': {'nginx': {}, 'iptables': {}}
+    },
+    'db': {
+        'name': 'db', 'public_ip': '1.1.1.2', 'private_ip': '10.0.0.2',
+        'components': {'postgres': {}, 'iptables': {}}
+    }
+}
+
+
+def test_hosts_inventory(monkeypatch, tmp_path):
+    hosts_file = tmp_path / 'hosts.json'
+    monkeypatch.setattr(
+        DeploySettings, 'settings_cache_file', property(lambda _: hosts_file))
+    inventory = HostsInventory()
+
+    assert inventory.get_by_component('nginx') == []
+
+    hosts_file.write_text(json.dumps(HOSTS))
+    assert inventory.get_by_name('db')['public_ip'] == '1.1.1.2'
+    assert [host['name'] for host in inventory.get_by_ips(
+        ['10.0.0.2', '1.1.1.1'])] == ['web', 'db']
+    assert [host['name'] for host in inventory.get_by_component(
+        'iptables')] == ['web', 'db']
+
+    del HOSTS['web']
+    hosts_file.write_text(json.dumps(HOSTS))
+    assert inventory.get_by_name('web') is None
+    assert len(inventory.get_by_component('iptables')) == 1
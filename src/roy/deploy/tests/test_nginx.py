@@ -0,0 +1,75 @@
+import asyncio
+
+from pathlib import Path
+
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.components.nginx import NginxSettings, NginxTasks
+
+
+def test_nginx_tuning_overrides():
+    hardware = {
+        'cores': 2, 'memory': 1024 ** 2, 'nofile': 4096, 'file_max': 9000}
+    tuning = NginxSettings().tune(**hardware)
+    assert tuning['workers'] == 2
+    assert tuning['rlimit_nofile'] == 2250
+    assert tuning['cpu_affinity']
+    assert tuning['proxy']['buffers'] == '8 8k'
+
+    settings = NginxSettings({
+        'workers': 1, 'connections': 500, 'proxy': {'buffering': False}})
+    tuning = settings.tune(**hardware)
+    assert (tuning['workers'], tuning['connections']) == (1, 500)
+    assert not tuning['cpu_affinity']
+    assert not tuning['proxy']['buffering']
+
+
+class ConfigsTransport:
+    """Keep uploaded configs in memory, answer hardware facts."""
+
+    def __init__(self):
+        self.files = {}
+
+    async def run(
+            self, user, host, port, command, interactive=False, input=None,
+            timeout=None):
+        if command.startswith('nproc --all;'):
+            return '2\nMemTotal: 1048576 kB\n4096\n9000'
+        if command.startswith('cat > '):
+            self.files[Path(command[len('cat > '):]).name] = input
+        return ''
+
+
+class UpstreamTasks:
+    def __init__(self, servers):
+        self.servers = servers
+
+    async def get_nginx_upstream_servers(self):
+        return self.servers
+
+
+def test_nginx_upstreams_rendered(monkeypatch):
+    manager = DeployTasksManager()
+    manager.transport = ConfigsTransport()
+    tasks = NginxTasks(manager, asyncio.Lock(), {})
+    components = {
+        'django': [UpstreamTasks([('10.0.0.1:8000', 1)])],
+        'python': [UpstreamTasks([])],
+    }
+
+    def get_all_manager_tasks(name=''):
+        return iter(components.get(name, []))
+
+    async def sync_systemd_units():
+        pass
+
+    monkeypatch.setattr(tasks, 'get_all_manager_tasks', get_all_manager_tasks)
+    monkeypatch.setattr(tasks, '_sync_systemd_units', sync_systemd_units)
+    asyncio.run(tasks.sync())
+    files = manager.transport.files
+
+    assert 'upstream roy_django {' in files['upstreams.conf']
+    assert 'server 10.0.0.1:8000 weight=1' in files['upstreams.conf']
+    assert 'roy_python' not in files['upstreams.conf']
+    assert 'proxy_http_version 1.1;\nproxy_set_header Connection "";' in \
+        files['upstreams.params']
+    assert 'proxy_set_header Connection "";' in files['nginx.conf']
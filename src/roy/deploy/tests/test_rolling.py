@@ -0,0 +1,22 @@
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.components.django import DjangoTasks
+
+
+def test_rolling_batches():
+    manager = DeployTasksManager()
+    hosts = ['web-1', 'web-2', 'web-3']
+
+    # rolling is opt-in, by default all hosts restart at once
+    assert manager._get_batches(DjangoTasks, 'restart', hosts) == [hosts]
+
+    manager.rolling = {'batch': 1, 'percent': 0, 'pause': 0}
+    assert manager._get_batches(DjangoTasks, 'restart', hosts) == [
+        ['web-1'], ['web-2'], ['web-3']]
+    assert manager._get_batches(DjangoTasks, 'start', hosts) == [hosts]
+
+    manager.rolling = {'batch': 0, 'percent': 50, 'pause': 0}
+    assert manager._get_batches(DjangoTasks, 'restart', hosts) == [
+        ['web-1', 'web-2'], ['web-3']]
+
+    manager.rolling = {'batch': 0, 'percent': 0, 'pause': 0}
+    assert manager._get_batches(DjangoTasks, 'restart', hosts) == [hosts]
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from roy.utils.os import RunInShellError
+from roy.utils.tasks import TaskRunError
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.ssh import SSHConnectionError, SSHTransport
+from roy.deploy.components.redis import RedisTasks
+
+
+class FailingTransport(SSHTransport):
+    def __init__(self, stderr):
+        super().__init__(multiplex=False)
+        self.stderr = stderr
+        self.calls = 0
+
+    async def run(self, *args, **kwargs):
+        self.calls += 1
+        return await super().run(*args, **kwargs)
+
+    def _get_ssh_command(self, user, host, port, command, interactive=False):
+        return f'echo "{self.stderr}" >&2; exit 255'
+
+
+@pytest.mark.parametrize('stderr, calls', [
+    ('ssh: connect to host 10.0.0.1 port 22: Connection refused', 3),
+    ('Connection closed by 10.0.0.1 port 22', 3),
+    ('script failed', 1)
+])
+def test_only_connection_errors_retried(stderr, calls):
+    manager = DeployTasksManager()
+    manager.transport = FailingTransport(stderr)
+    manager.retries = {'attempts': 3, 'delay': 0, 'backoff': 1}
+    tasks = RedisTasks(manager, asyncio.Lock(), {})
+
+    with pytest.raises(TaskRunError) as info:
+        asyncio.run(tasks._run('exit 255'))
+    assert manager.transport.calls == calls
+    assert isinstance(info.value.__cause__, RunInShellError)
+    assert isinstance(info.value.__cause__, SSHConnectionError) == (
+        calls > 1)
@@ -0,0 +1,109 @@
+import asyncio
+import subprocess
+
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.components.django import DjangoTasks
+
+
+def get_tasks(**systemd):
+    tasks = DjangoTasks(DeployTasksManager(), asyncio.Lock(), {})
+    tasks.settings._data['systemd'] = dict(
+        tasks.settings._data['systemd'], **systemd)
+    return tasks
+
+
+async def render(tasks):
+    services = [service async for service in tasks._get_systemd_services()]
+    return services, await tasks._render_systemd_unit(services[0])
+
+
+def test_template_mode_instance_ports():
+    tasks = get_tasks(mode='template', instances={'count': 3})
+    services, unit = asyncio.run(render(tasks))
+
+    assert [s['name'] for s in services] == [
+        'django@1.service', 'django@2.service', 'django@3.service']
+    assert 'Environment=PORT' not in unit
+    assert '--port ${PORT}' in unit
+    assert [tasks._render_systemd_dropin(s) for s in services] == [
+        f'[Service]\nEnvironment=PORT={port}\n'
+        for port in (8000, 8001, 8002)
+    ]
+
+
+def test_template_mode_upstream_servers():
+    tasks = get_tasks(mode='template', instances={'count': 3})
+    tasks.settings.private_ip = '10.0.0.1'
+    servers = asyncio.run(tasks.get_nginx_upstream_servers())
+
+    assert servers == [
+        ('10.0.0.1:8000', 1), ('10.0.0.1:8001', 1), ('10.0.0.1:8002', 1)]
+
+
+def test_socket_mode_units():
+    tasks = get_tasks(mode='socket', instances={'count': 2})
+    tasks.settings.private_ip = '10.0.0.1'
+    services, unit = asyncio.run(render(tasks))
+    socket = asyncio.run(tasks._render_systemd_socket())
+
+    assert [s['name'] for s in services] == [
+        'django@1.service', 'django@2.service']
+    assert 'ListenStream=10.0.0.1:8000\n' in socket
+    assert 'Service=django@1.service\n' in socket
+    assert 'Sockets=django.socket\n' in unit
+    assert '--fd 3' in unit
+    assert 'Environment=PORT' not in unit
+    assert not tasks._render_systemd_dropin(services[1])
+
+
+def record_commands(tasks):
+    commands = []
+
+    async def run(command, *args, **kwargs):
+        commands.append(command)
+        return ''
+
+    tasks._run = run
+    return commands
+
+
+def test_health_gate_listen_ip():
+    tasks = get_tasks(mode='template', instances={'count': 2})
+    tasks.settings.private_ip = '10.0.0.1'
+    tasks.settings.public_ip = '1.1.1.1'
+    commands = record_commands(tasks)
+    services, _ = asyncio.run(render(tasks))
+    asyncio.run(tasks._wait_healthy(services[1]))
+
+    assert '/dev/tcp/10.0.0.1/8001' in commands[0]
+
+    tasks.settings._data['listen_private_ip'] = False
+    asyncio.run(tasks._wait_healthy(services[1]))
+    assert '/dev/tcp/1.1.1.1/8001' in commands[1]
+
+
+def test_socket_mode_health_gate():
+    tasks = get_tasks(mode='socket', instances={'count': 2})
+    commands = record_commands(tasks)
+    services, _ = asyncio.run(render(tasks))
+
+    # systemd holds socket port open, it says nothing about instance
+    assert not tasks._get_health(services[0])
+    asyncio.run(tasks._wait_healthy(services[0]))
+    assert not commands
+
+    service = dict(services[0], health={'url': 'http://localhost/ping'})
+    asyncio.run(tasks._wait_healthy(service))
+    assert "wget -q -O /dev/null 'http://localhost/ping'" in commands[0]
+
+
+def test_units_listing_quoted():
+    tasks = get_tasks(name="it's_100%d_{instance}.service")
+    commands = record_commands(tasks)
+    asyncio.run(tasks._sync_systemd_units())
+    printf = next(c for c in commands if c.startswith('printf'))
+    listing = subprocess.run(
+        printf.split(' > ')[0], shell=True, capture_output=True, text=True)
+
+    assert listing.stdout == (
+        f"{tasks.settings.systemd_dir}/it's_100%d_1.service\n")
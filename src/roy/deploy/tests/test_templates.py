@@ -0,0 +1,31 @@
+import asyncio
+
+from roy.deploy.settings import SETTINGS
+from roy.deploy.templates import get_environment, get_template
+
+
+def render(path):
+    return asyncio.run(get_template(path).render_async(port=80))
+
+
+def test_bytecode_cache_created_lazily(tmp_path, cache_dir):
+    template = tmp_path / 'server.conf'
+    template.write_text('listen {{ port }};')
+
+    get_environment()
+    assert not cache_dir.exists()
+    assert render(template) == 'listen 80;'
+    assert list((cache_dir / 'jinja2').iterdir())
+
+
+def test_bytecode_cache_fail_soft(tmp_path, monkeypatch):
+    template = tmp_path / 'server.conf'
+    template.write_text('listen {{ port }};')
+    # cache dir can't be created inside regular file
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    monkeypatch.setitem(
+        SETTINGS._data, 'cache', dict(SETTINGS.cache, dir=str(blocker)))
+    get_environment.cache_clear()
+
+    assert render(template) == 'listen 80;'
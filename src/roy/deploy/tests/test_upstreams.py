@@ -0,0 +1,26 @@
+import asyncio
+
+from roy.deploy.manager import DeployTasksManager
+from roy.deploy.components.django import DjangoSettings
+from roy.deploy.components.python import PythonTasks
+
+
+def test_instance_ports():
+    settings = DjangoSettings({'port': 9000})
+    assert settings.instance_port(1) == 9000
+    assert settings.instance_port(3) == 9002
+    assert settings.instance_port('%i') == 9000
+
+    settings = DjangoSettings({
+        'port': 9000, 'systemd': {'mode': 'template'}})
+    assert settings.instance_port(3) == 9002
+
+    settings = DjangoSettings({'port': 9000, 'systemd': {'mode': 'socket'}})
+    assert settings.instance_port(3) == 9000
+    assert settings.listen == '--fd 3'
+
+
+def test_python_without_port_has_no_upstream():
+    tasks = PythonTasks(DeployTasksManager(), asyncio.Lock(), {})
+    assert not tasks.settings.listens
+    assert asyncio.run(tasks.get_nginx_upstream_servers()) == []
@@ -1,9 +1,10 @@
-from copy import deepcopy
+from collections.abc import Mapping
 
 
 def update_dict_recur(
         original: dict, from_dict: dict, copy: bool = True) -> dict:
-    """Update dict recursively.
+    """Update dict recursively, with `copy` only dicts on updated paths
+    are copied and untouched nested values are shared with original.
 
     >>> original = {0: 'zero', 1: {1: 'one'}, 2: {2: {3: 3}}, 6: 'item'}
     >>> update_with = {0: 1, 1: {1: 'hello'}, 2: {2: {4: 4}}, 5: 1}
@@ -20,22 +21,90 @@ def update_dict_recur(
     1
     >>> result[6]  # same
     'item'
-    >>> original = {1: 'one', 2: {2: 2}}
+    >>> original = {1: 'one', 2: {2: 2}, 3: {3: 3}}
     >>> update_with = {1: 1, 2: {2: 'two'}}
     >>> result = update_dict_recur(original, update_with, copy=True)
     >>> original is not result
     True
-    >>> result[2][2]
-    'two'
+    >>> result[2][2], original[2][2]
+    ('two', 2)
+    >>> result[3] is original[3]  # not updated, shared with original
+    True
     """
     if copy:
-        original = deepcopy(original)
+        original = dict(original)
 
     for key, value in from_dict.items():
-        if isinstance(value, dict) and key in original:
-            original[key] = update_dict_recur(
-                original.get(key, {}), value)
+        if isinstance(value, Mapping) and \
+                isinstance(original.get(key), Mapping):
+            original[key] = update_dict_recur(original[key], value, copy)
         else:
             original[key] = value
 
     return original
+
+
+class LayeredMapping(Mapping):
+    """Read only view of dicts merged like `update_dict_recur`, later
+    layers override earlier ones, nested dicts are merged lazily on
+    access without building new dict and are read only too, other
+    nested values like lists are returned as is.
+
+    >>> default = {'port': 80, 'systemd': {'boot': True, 'count': 1}}
+    >>> view = LayeredMapping(default, {'systemd': {'count': 4}})
+    >>> view['port'], view['systemd']['count'], view['systemd']['boot']
+    (80, 4, True)
+    >>> sorted(view)
+    ['port', 'systemd']
+    >>> view.to_dict() == update_dict_recur(default, {'systemd': {'count': 4}})
+    True
+    >>> view['systemd']['count'] = 2
+    Traceback (most recent call last):
+    ...
+    TypeError: 'LayeredMapping' object does not support item assignment
+    >>> view['missing']
+    Traceback (most recent call last):
+    ...
+    KeyError: 'missing'
+    """
+
+    def __init__(self, *layers: Mapping):
+        self._layers = layers
+
+    def __getitem__(self, key):
+        values = []
+        for layer in reversed(self._layers):
+            if key not in layer:
+                continue
+            value = layer[key]
+            if not isinstance(value, Mapping):
+                if not values:
+                    return value
+                break
+            values.append(value)
+
+        if not values:
+            raise KeyError(key)
+        return LayeredMapping(*reversed(values))
+
+    def __iter__(self):
+        return iter(dict.fromkeys(
+            key for layer in self._layers for key in layer))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()!r})'
+
+    def copy(self) -> dict:
+        """Shallow copy into plain dict, nested dicts stay read only."""
+        return dict(self)
+
+    def to_dict(self) -> dict:
+        """Materialize view into plain dict."""
+        return {
+            key: value.to_dict() if isinstance(value, LayeredMapping)
+            else value
+            for key, value in self.items()
+        }
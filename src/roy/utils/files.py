@@ -1,6 +1,137 @@
+import os
+import mmap
 import zlib
+import hashlib
 import pathlib
 
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+
+_hashes = {}
+
+
+class CRC32:
+    """Streaming crc32 with hashlib like interface."""
+    name = 'crc32'
+
+    def __init__(self, data: bytes = b''):
+        self.value = zlib.crc32(data)
+
+    def update(self, data: bytes):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+
+def new_hash(algorithm: str):
+    """Create hash object by name, 'crc32' or any from hashlib."""
+    if algorithm == 'crc32':
+        return CRC32()
+    return hashlib.new(algorithm)
+
+
+def _read_chunks(f, chunk_size: int, use_mmap: bool):
+    size = os.fstat(f.fileno()).st_size
+    if not use_mmap or not size:
+        yield from iter(lambda: f.read(chunk_size), b'')
+        return
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        with memoryview(data) as view:
+            for offset in range(0, size, chunk_size):
+                with view[offset:offset + chunk_size] as chunk:
+                    yield chunk
+
+
+def calc_hashes_for_file(
+        path: pathlib.Path, algorithms: tuple = ('sha256',),
+        chunk_size: int = CHUNK_SIZE, use_mmap: bool = False) -> dict:
+    """Read file by chunks once and return hex digests for all
+    algorithms, results are cached until file size, mtime or inode
+    is changed.
+
+    >>> import tempfile
+    >>> import pathlib
+    >>> fp = tempfile.NamedTemporaryFile()
+    >>> fp.write(b'Some data')
+    9
+    >>> fp.flush()
+    >>> hashes = calc_hashes_for_file(
+    ...     pathlib.Path(fp.name), ('crc32', 'md5'), use_mmap=True)
+    >>> hashes['crc32'], hashes['md5'][:16]
+    ('5b336bbd', '5b82f8bf4df2bfb0')
+    """
+    stat = os.stat(path)
+    stamp = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    path = str(path)
+
+    hashes, digests = {}, {}
+    for algorithm in algorithms:
+        cached_stamp, hexdigest = _hashes.get((path, algorithm), (None, ''))
+        if cached_stamp == stamp:
+            hashes[algorithm] = hexdigest
+        else:
+            digests[algorithm] = new_hash(algorithm)
+
+    if digests:
+        with open(path, 'rb') as f:
+            for chunk in _read_chunks(f, chunk_size, use_mmap):
+                for digest in digests.values():
+                    digest.update(chunk)
+
+        for algorithm, digest in digests.items():
+            hashes[algorithm] = digest.hexdigest()
+            _hashes[(path, algorithm)] = (stamp, hashes[algorithm])
+
+    return hashes
+
+
+def calc_hash_for_file(
+        path: pathlib.Path, algorithm: str = 'sha256',
+        chunk_size: int = CHUNK_SIZE, use_mmap: bool = False) -> str:
+    return calc_hashes_for_file(
+        path, (algorithm,), chunk_size, use_mmap)[algorithm]
+
+
+def calc_hashes_for_dir(
+        path: pathlib.Path, algorithm: str = 'sha256',
+        exclude: tuple = (), workers: int = None) -> dict:
+    """Hash all files in directory tree in thread pool, return hex
+    digests by relative paths.
+
+    >>> import tempfile
+    >>> import pathlib
+    >>> root = pathlib.Path(tempfile.mkdtemp())
+    >>> (root / 'logs').mkdir()
+    >>> _ = (root / 'logs' / 'error.log').write_bytes(b'error')
+    >>> _ = (root / 'data').write_bytes(b'Some data')
+    >>> calc_hashes_for_dir(root, 'crc32')
+    {'data': '5b336bbd', 'logs/error.log': '5dddbc71'}
+    >>> calc_hashes_for_dir(root, 'crc32', exclude=('logs',))
+    {'data': '5b336bbd'}
+    """
+    path = pathlib.Path(path)
+    files = []
+    for root, dirs, names in os.walk(path):
+        root = pathlib.Path(root)
+        dirs[:] = [
+            name for name in dirs
+            if str((root / name).relative_to(path)) not in exclude
+        ]
+        for name in names:
+            relative = str((root / name).relative_to(path))
+            if relative not in exclude:
+                files.append(relative)
+
+    with ThreadPoolExecutor(workers) as executor:
+        hashes = executor.map(
+            lambda name: calc_hash_for_file(path / name, algorithm),
+            files
+        )
+        return dict(sorted(zip(files, hashes)))
+
 
 def calc_crc32_for_file(path: pathlib.Path) -> int:
     """Read file by path and return crc32 sum integer.
@@ -14,5 +145,19 @@ def calc_crc32_for_file(path: pathlib.Path) -> int:
     >>> calc_crc32_for_file(pathlib.Path(fp.name))
     1530096573
     """
-    with open(str(path), 'rb') as f:
-        return zlib.crc32(f.read())
+    return int(calc_hash_for_file(path, 'crc32'), 16)
+
+
+def calc_sha256_for_file(path: pathlib.Path, chunk_size: int = 65536) -> str:
+    """Read file by chunks and return sha256 hex digest.
+
+    >>> import tempfile
+    >>> import pathlib
+    >>> fp = tempfile.NamedTemporaryFile()
+    >>> fp.write(b'Some data')
+    9
+    >>> fp.flush()
+    >>> calc_sha256_for_file(pathlib.Path(fp.name))[:16]
+    '1fe638b478f8f0b2'
+    """
+    return calc_hash_for_file(path, 'sha256', chunk_size)
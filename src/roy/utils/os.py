@@ -1,10 +1,27 @@
 import os
 import pwd
+import time
+import signal
+import socket
+import typing
 import asyncio
 import pathlib
+import functools
+import ipaddress
+
+from collections import deque
+
+
+STREAM_CHUNK_SIZE = 65536
 
 
 class RunInShellError(Exception):
+    def __init__(self, message: str = '', code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+class RunInShellTimeoutError(RunInShellError):
     pass
 
 
@@ -16,19 +33,206 @@ def get_homepath() -> pathlib.Path:
     return pathlib.Path(os.path.expanduser('~'))
 
 
-async def run_in_shell(command: str, interactive: bool = False) -> str:
+def _read_ipv4_addresses() -> list:
+    """Parse local ipv4 addresses from kernel routing trie."""
+    addresses, candidate = [], None
+    with open('/proc/net/fib_trie') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('|--'):
+                candidate = line.split()[-1]
+            elif line == '/32 host LOCAL' and candidate:
+                if candidate not in addresses:
+                    addresses.append(candidate)
+                candidate = None
+    return addresses
+
+
+def _read_ipv6_addresses() -> list:
+    """Parse global ipv6 addresses of all interfaces."""
+    addresses = []
+    try:
+        with open('/proc/net/if_inet6') as f:
+            for line in f:
+                address, _, _, scope, *_ = line.split()
+                if int(scope, 16) == 0:
+                    addresses.append(str(ipaddress.IPv6Address(
+                        bytes.fromhex(address))))
+    except FileNotFoundError:
+        pass
+    return addresses
+
+
+def _resolve_addresses() -> list:
+    try:
+        infos = socket.getaddrinfo(socket.gethostname(), None)
+    except OSError:
+        return []
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+
+@functools.lru_cache(maxsize=None)
+def get_local_ips() -> tuple:
+    """Return non loopback addresses of this host like `hostname -I`
+    does, read once per process without spawning subprocesses.
+
+    >>> isinstance(get_local_ips(), tuple)
+    True
+    """
+    try:
+        addresses = _read_ipv4_addresses() + _read_ipv6_addresses()
+    except OSError:
+        addresses = _resolve_addresses()
+    return tuple(
+        address for address in addresses
+        if not ipaddress.ip_address(address).is_loopback and
+        not ipaddress.ip_address(address).is_link_local
+    )
+
+
+def _kill_process(proc, detached: bool):
+    """Kill process with its children if it was started in own session
+    or just process itself."""
+    if not detached:
+        proc.kill()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def run_in_shell(
+        command: str, interactive: bool = False, input: str = None,
+        timeout: float = None) -> str:
+    """Run command and return its output. With `timeout` command runs
+    in own session and its process group is killed after `timeout`
+    seconds or on cancellation, it has no controlling terminal then, so
+    ssh needs agent for keys with passphrase and known host keys.
+
+    >>> asyncio.run(run_in_shell('echo test'))
+    'test\\n'
+    >>> try:
+    ...     asyncio.run(run_in_shell('sleep 10', timeout=0.1))
+    ... except RunInShellTimeoutError as err:
+    ...     print(err)
+    Shell command "sleep 10" timed out after 0.1s
+    >>> sid = [str(os.getsid(0))]
+    >>> asyncio.run(run_in_shell('ps -o sid= -p $$')).split() == sid
+    True
+    >>> asyncio.run(run_in_shell('ps -o sid= -p $$', timeout=5)).split() == sid
+    False
+    """
     stdout = stderr = asyncio.subprocess.PIPE
     if interactive:
         stdout = stderr = None
+    stdin = asyncio.subprocess.PIPE if input is not None else None
+    detached = bool(timeout) and not interactive
     proc = await asyncio.create_subprocess_shell(
-        command, stdout=stdout, stderr=stderr
+        command, stdin=stdin, stdout=stdout, stderr=stderr,
+        start_new_session=detached
     )
-    stdout, stderr = await proc.communicate()
+    if input is not None:
+        input = input.encode()
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            proc.communicate(input), timeout or None)
+    except asyncio.TimeoutError:
+        raise RunInShellTimeoutError(
+            f'Shell command "{command}" timed out after {timeout}s')
+    finally:
+        if proc.returncode is None:
+            _kill_process(proc, detached)
+            await proc.wait()
+
     if stderr and proc.returncode != 0:
         raise RunInShellError(
             f'Shell command "{command}" finished with '
             f'error code [{proc.returncode}]:\n'
-            f'{stderr.decode()} '
+            f'{stderr.decode()} ', proc.returncode
         )
     if stdout:
         return stdout.decode()
+
+
+async def stream_in_shell(
+        command: str, prefix: str = '', input: str = None,
+        timeout: float = None, tail: int = 100
+) -> typing.AsyncIterator[str]:
+    """Run command and yield stdout and stderr lines as they arrive,
+    only last `tail` lines are kept for error report. With `timeout`
+    command runs in own session like in `run_in_shell` and its process
+    group is killed on timeout or cancellation.
+
+    >>> async def collect(command, **kwargs):
+    ...     return [line async for line in stream_in_shell(command, **kwargs)]
+    >>> asyncio.run(collect('echo one; echo two >&2', prefix='[local] '))
+    ['[local] one', '[local] two']
+    >>> try:
+    ...     asyncio.run(collect('echo failed; exit 3'))
+    ... except RunInShellError as err:
+    ...     print(err)
+    Shell command "echo failed; exit 3" finished with error code [3]:
+    failed
+    >>> try:
+    ...     asyncio.run(collect('echo started; sleep 10', timeout=0.2))
+    ... except RunInShellError as err:
+    ...     print(err)
+    Shell command "echo started; sleep 10" timed out after 0.2s:
+    started
+    """
+    stdin = asyncio.subprocess.PIPE if input is not None else None
+    detached = bool(timeout)
+    proc = await asyncio.create_subprocess_shell(
+        command, stdin=stdin, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT, start_new_session=detached
+    )
+    lines = deque(maxlen=tail)
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        if input is not None:
+            proc.stdin.write(input.encode())
+            await proc.stdin.drain()
+            proc.stdin.close()
+
+        pending = b''
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            try:
+                chunk = await asyncio.wait_for(
+                    proc.stdout.read(STREAM_CHUNK_SIZE), remaining)
+            except asyncio.TimeoutError:
+                raise RunInShellTimeoutError(
+                    f'Shell command "{command}" timed out after '
+                    f'{timeout}s:\n' + '\n'.join(lines)
+                )
+            if not chunk:
+                break
+
+            *chunk_lines, pending = (pending + chunk).split(b'\n')
+            if len(pending) > STREAM_CHUNK_SIZE:
+                chunk_lines.append(pending)
+                pending = b''
+            for line in chunk_lines:
+                line = line.decode(errors='replace')
+                lines.append(line)
+                yield f'{prefix}{line}'
+
+        if pending:
+            line = pending.decode(errors='replace')
+            lines.append(line)
+            yield f'{prefix}{line}'
+
+        returncode = await proc.wait()
+    finally:
+        if proc.returncode is None:
+            _kill_process(proc, detached)
+            await proc.wait()
+
+    if returncode != 0:
+        raise RunInShellError(
+            f'Shell command "{command}" finished with '
+            f'error code [{returncode}]:\n' + '\n'.join(lines), returncode
+        )
@@ -1,10 +1,13 @@
+import sys
 import logging
 import asyncio
 import typing
 
-from functools import partial, wraps
+from fnmatch import fnmatch
+from functools import partial
+from collections import deque
 
-from .os import run_in_shell, RunInShellError
+from .os import run_in_shell, stream_in_shell, RunInShellError
 
 
 def register(method: typing.Any) -> typing.Any:
@@ -29,8 +32,28 @@ def after(method: typing.Callable):
     return _register_hook('__task__after__', method)
 
 
+def depends(*commands: str):
+    """Run task only after requested commands matched by patterns like
+    'python.setup' or 'nginx.*' are finished."""
+    def decorator(method):
+        method.__task__depends__ = list(commands)
+        return method
+    return decorator
+
+
+def timeout(seconds: float):
+    """Cancel task if it is not finished in time, overrides manager
+    `task_timeout` for decorated task."""
+    def decorator(method):
+        method.__task__timeout__ = seconds
+        return method
+    return decorator
+
+
 register.before = before
 register.after = after
+register.depends = depends
+register.timeout = timeout
 
 
 class TaskRunError(Exception):
@@ -51,41 +74,151 @@ class Tasks:
             raise ValueError('Please define NAMESPACE for {}'.format(cls))
         return namespace
 
-    async def _local(self, command, interactive=False, debug=True):
+    async def _local(
+            self, command, interactive=False, debug=True, stream=False,
+            timeout=None):
         try:
             if self._manager.debug and debug:
                 print(f"[local] {command}")
-            return await run_in_shell(command, interactive)
+            if stream:
+                return await self._local_stream(command, debug, timeout)
+            return await run_in_shell(
+                command, interactive, timeout=timeout)
         except RunInShellError as err:
             raise TaskRunError(err)
 
+    async def _local_stream(self, command, debug=True, timeout=None, tail=100):
+        lines = deque(maxlen=tail)
+        async for line in stream_in_shell(command, timeout=timeout):
+            if self._manager.debug and debug:
+                print(f"[local] {line}")
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class TasksRegistry(dict):
+    """Tasks classes by namespace, classes provided by loaders are
+    imported only on first access to their namespace. Loaders are keyed
+    by expected namespace, all of them are loaded when requested one is
+    declared by other class."""
+
+    def __init__(self, loaders: dict = None):
+        super().__init__()
+        self.loaders = dict(loaders or {})
+
+    def __missing__(self, namespace):
+        for key in [namespace, *self.loaders]:
+            if key in self.loaders:
+                task_class = self.loaders.pop(key)()
+                self.setdefault(task_class.get_namespace(), task_class)
+            if super().__contains__(namespace):
+                return super().__getitem__(namespace)
+        raise KeyError(namespace)
+
+    def __contains__(self, namespace):
+        try:
+            self[namespace]
+        except KeyError:
+            return False
+        return True
+
 
 class TasksManager:
     def __init__(self):
-        self.tasks = {}
+        self.tasks = TasksRegistry()
         self.debug = False
+        self.concurrency = 0
+        self.task_timeout = 0
+        self._semaphore = None
 
     def register(self, task_class):
         self.tasks[task_class.get_namespace()] = task_class
 
-    def run_task(self, task_class, name, args):
-        task = getattr(task_class(self), name)
-        return asyncio.run(task(*args))
+    def get_task_timeout(self, task_class, name):
+        method = getattr(task_class, name)
+        seconds = getattr(method, '__task__timeout__', self.task_timeout)
+        return seconds or None
 
-    def run_hooks(self, task_class, name, hook_name, instance=None):
+    async def run_task(self, task_class, name, args):
+        task = getattr(task_class(self), name)
+        seconds = self.get_task_timeout(task_class, name)
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(task(*args), seconds)
+            except asyncio.TimeoutError:
+                raise TaskRunError(
+                    f'Task "{task_class.get_namespace()}.{name}" timed out '
+                    f'after {seconds}s')
+
+    @staticmethod
+    def _sort_tasks(tasks_to_run):
+        """Resolve dependencies between requested commands, commands
+        from one namespace keep their order, others wait only for
+        declared dependencies."""
+        dependencies = []
+        for index, (namespace, task_class, name, _) in enumerate(
+                tasks_to_run):
+            patterns = getattr(
+                getattr(task_class, name), '__task__depends__', [])
+            current = set()
+            for other_index, (other_namespace, _, other_name, _) in \
+                    enumerate(tasks_to_run):
+                if other_namespace == namespace:
+                    if other_index < index:
+                        current.add(other_index)
+                elif any(fnmatch(f'{other_namespace}.{other_name}', pattern)
+                         for pattern in patterns):
+                    current.add(other_index)
+            dependencies.append(current)
+
+        ordered = []
+        while len(ordered) < len(tasks_to_run):
+            ready = [
+                index for index, current in enumerate(dependencies)
+                if index not in ordered and current.issubset(ordered)
+            ]
+            if not ready:
+                commands = [
+                    f'{namespace}.{name}'
+                    for index, (namespace, _, name, _) in enumerate(
+                        tasks_to_run)
+                    if index not in ordered
+                ]
+                raise ValueError(f'Circular task dependencies: {commands}')
+            ordered.extend(ready)
+        return ordered, dependencies
+
+    async def run_tasks(self, tasks_to_run):
+        """Run commands concurrently in one event loop, every command
+        starts as soon as all its dependencies are finished."""
+        ordered, dependencies = self._sort_tasks(tasks_to_run)
+
+        async def run_after(waiting, task_class, name, args):
+            await asyncio.gather(*waiting)
+            return await self.run_task(task_class, name, args)
+
+        running = {}
+        for index in ordered:
+            _, task_class, name, args = tasks_to_run[index]
+            waiting = [running[other] for other in dependencies[index]]
+            running[index] = asyncio.ensure_future(
+                run_after(waiting, task_class, name, args))
+
+        return await asyncio.gather(*[
+            running[index] for index in range(len(tasks_to_run))
+        ])
+
+    async def run_hooks(self, task_class, name, hook_name, instance=None):
         instance = instance or task_class(self)
         task = getattr(instance, name)
         hooks = getattr(task, f'__task__{hook_name}__', [])
-
-        if not hooks:
-            return
-
-        async def _run_hooks_gather():
-            await asyncio.gather(*[hook(instance) for hook in hooks])
-
-        asyncio.run(_run_hooks_gather())
+        await asyncio.gather(*[hook(instance) for hook in hooks])
 
     def run(self, *commands) -> typing.Any:
+        return asyncio.run(self.run_async(*commands))
+
+    async def run_async(self, *commands) -> typing.Any:
+        """Run hooks and tasks for commands inside one event loop."""
         result = None
         before_hooks_to_run = []
         after_hooks_to_run = []
@@ -117,20 +250,21 @@ class TasksManager:
             )
 
             if getattr(method, '__task__', None) and name == method.__name__:
-                tasks_to_run.append(
-                    partial(self.run_task, task_class, name, args))
+                tasks_to_run.append((namespace, task_class, name, args))
 
             after_hooks_to_run.append(
                 partial(self.run_hooks, task_class, name, 'after')
             )
 
+        self._semaphore = asyncio.Semaphore(self.concurrency or sys.maxsize)
+
         for run_hooks in before_hooks_to_run:
-            run_hooks()
+            await run_hooks()
 
-        for task in tasks_to_run:
-            result = task()
+        if tasks_to_run:
+            result = (await self.run_tasks(tasks_to_run))[-1]
 
         for run_hooks in after_hooks_to_run:
-            run_hooks()
+            await run_hooks()
 
         return result
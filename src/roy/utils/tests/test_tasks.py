@@ -1,7 +1,9 @@
 import asyncio
 import pytest
 
-from roy.utils.tasks import TasksManager, Tasks, register, TaskRunError
+from roy.utils.tasks import (
+    TasksManager, TasksRegistry, Tasks, register, TaskRunError
+)
 
 
 class SimpleTasks(Tasks):
@@ -48,6 +50,15 @@ class SimpleTasks(Tasks):
     async def will_raise(self):
         return await self._local('asdf1_123_342f')
 
+    @register
+    @register.timeout(0.1)
+    async def hangs(self):
+        await asyncio.sleep(10)
+
+    @register
+    async def hangs_in_shell(self):
+        return await self._local('sleep 10', timeout=0.1)
+
 
 def test_tasks_register_and_run():
     manager = TasksManager()
@@ -74,6 +85,41 @@ def test_tasks_register_and_run():
         manager.run('simple.will_raise')
 
 
+def test_tasks_registry_loaders():
+    class OtherTasks(Tasks):
+        NAMESPACE = 'other'
+
+    loaded = []
+
+    def loader(task_class):
+        return lambda: loaded.append(task_class) or task_class
+
+    registry = TasksRegistry({
+        'simple': loader(SimpleTasks), 'module': loader(OtherTasks)})
+    assert registry['simple'] is SimpleTasks
+    assert loaded == [SimpleTasks]
+
+    assert 'other' in registry
+    assert registry['other'] is OtherTasks
+    assert 'module' not in registry
+    assert not registry.loaders
+
+
+def test_tasks_timeouts():
+    manager = TasksManager()
+    manager.register(SimpleTasks)
+
+    with pytest.raises(TaskRunError, match='timed out after 0.1s'):
+        manager.run('simple.hangs')
+
+    with pytest.raises(TaskRunError, match='timed out after 0.1s'):
+        manager.run('simple.hangs_in_shell')
+
+    manager.task_timeout = 0.1
+    with pytest.raises(TaskRunError, match='timed out'):
+        manager.run('simple.example:1')
+
+
 def test_tasks_hooks():
     manager = TasksManager()
     manager.register(SimpleTasks)
@@ -83,3 +129,50 @@ def test_tasks_hooks():
     assert result == 6
     assert SimpleTasks.BEFORE_CALLED == 2
     assert SimpleTasks.AFTER_CALLED == 2
+
+
+class OrderTasks(Tasks):
+    NAMESPACE = 'order'
+
+    CALLS = []
+
+    @register
+    async def slow(self):
+        await asyncio.sleep(0.1)
+        self.CALLS.append('order.slow')
+
+    @register
+    @register.depends('other.*')
+    async def last(self):
+        self.CALLS.append('order.last')
+
+
+class OtherTasks(Tasks):
+    NAMESPACE = 'other'
+
+    @register
+    async def fast(self):
+        await asyncio.sleep(0.05)
+        OrderTasks.CALLS.append('other.fast')
+
+    @register
+    @register.depends('order.*')
+    async def cycle(self):
+        pass
+
+
+def test_tasks_dependencies():
+    manager = TasksManager()
+    manager.register(OrderTasks)
+    manager.register(OtherTasks)
+
+    manager.run('order.slow', 'order.last', 'other.fast')
+    # other namespace runs concurrently, same namespace keeps order
+    assert OrderTasks.CALLS == ['other.fast', 'order.slow', 'order.last']
+
+    OrderTasks.CALLS.clear()
+    manager.run('other.fast', 'order.last')
+    assert OrderTasks.CALLS == ['other.fast', 'order.last']
+
+    with pytest.raises(ValueError):
+        manager.run('order.last', 'other.cycle')